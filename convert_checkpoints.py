@@ -0,0 +1,39 @@
+# 기존 generator 체크포인트(EdgeModel_gen.pth, InpaintingModel_gen.pth)를 mmap 로딩용 형식으로 변환
+# iteration과 generator 가중치만 남기고(optimizer 상태 제거) zip 형식으로 다시 저장 -> 추론 서버 시작 시 파일을 읽지 않고 mmap
+# --output을 지정하지 않으면 제자리에서 변환 (학습을 이어갈 체크포인트는 --output으로 다른 디렉토리에 변환)
+#
+# python convert_checkpoints.py --checkpoints ./checkpoints/places2
+# python convert_checkpoints.py --checkpoints ./checkpoints/places2 --output ./checkpoints/places2_serving
+import os
+import argparse
+from src.checkpoint import convert_checkpoint
+from src.utils import create_dir
+
+
+def convert(checkpoints, output=None):
+    r"""converts every generator checkpoint found in the checkpoints directory"""
+    if output is not None:
+        create_dir(output)
+
+    converted = 0
+    for name in ('EdgeModel_gen.pth', 'InpaintingModel_gen.pth'):
+        path = os.path.join(checkpoints, name)
+        if not os.path.exists(path):
+            continue
+
+        target = os.path.join(output, name) if output is not None else path
+        state = convert_checkpoint(path, target)
+        print('%s converted to %s (iteration %d)' % (path, target, state['iteration']))
+        converted += 1
+
+    if converted == 0:
+        raise FileNotFoundError('no generator checkpoint found in %s' % checkpoints)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoints', type=str, default='./checkpoints/places2', help='model checkpoints path')
+    parser.add_argument('--output', type=str, help='directory the converted checkpoints are written to (default: converted in place)')
+    args = parser.parse_args()
+
+    convert(args.checkpoints, args.output)
@@ -0,0 +1,177 @@
+# 학습된 generator를 추론 전용 artifact로 export (spectral norm 제거, channels-last, TorchScript freeze)
+# config.yml에 BACKEND: torchscript를 지정하면 test/서버가 .pth 대신 export된 *_gen.pt를 바로 로드함
+# --format onnx: 마스킹을 포함한 forward를 ONNX 그래프(*_gen.onnx)로 export, BACKEND: onnx로 ONNX Runtime(cpu) 사용
+# --format int8: TEST_FLIST 이미지/마스크 일부로 calibration 후 int8 양자화(*_gen_int8.pt, cpu 전용), BACKEND: int8로 사용
+# --check: examples/ 이미지로 export된 TorchScript/ONNX 그래프와 PyTorch 결과 비교 (int8: fp32 대비 PSNR/MAE drift 출력)
+#
+# python export.py --checkpoints ./checkpoints/places2 --model 3
+# python export.py --checkpoints ./checkpoints/places2 --model 3 --format onnx --check
+# python export.py --checkpoints ./checkpoints/places2 --model 3 --format int8 --samples 100 --check
+import os
+import sys
+import argparse
+import numpy as np
+import torch
+from src.config import Config
+from src.dataset import Dataset
+from src.engine import InpaintEngine
+from src.metrics import PSNR
+from src.models import EdgeModel, InpaintingModel
+from src.export import export_torchscript, export_onnx, quantize_int8
+
+
+def build_models(config, model, backend='torch'):
+    r"""builds and loads the inference models needed by MODEL (1: edge, 2: inpaint, 3/4: both)"""
+    config.MODE = 2
+    config.BACKEND = backend
+
+    models = []
+    if model in (1, 3, 4):
+        models.append(EdgeModel(config, inference=True))
+    if model in (2, 3, 4):
+        models.append(InpaintingModel(config, inference=True))
+
+    for m in models:
+        if backend == 'torch' and not os.path.exists(m.gen_weights_path):
+            raise FileNotFoundError('%s not found' % m.gen_weights_path)
+
+        m.load()
+        m.to(config.DEVICE).eval()
+
+    return models
+
+
+def export(config, model=3, format='torchscript', samples=100):
+    r"""exports the generators needed by MODEL next to their checkpoints"""
+    if format == 'int8':
+        quantize(config, model, samples)
+        return
+
+    for m in build_models(config, model):
+        if format == 'onnx':
+            export_onnx(m, m.gen_onnx_path)
+            print('%s exported to %s' % (m.name, m.gen_onnx_path))
+        else:
+            export_torchscript(m, m.gen_script_path)
+            print('%s exported to %s' % (m.name, m.gen_script_path))
+
+
+def quantize(config, model, samples):
+    r"""quantizes the generators to int8, calibrated on a random sample of TEST_FLIST images and masks"""
+    config.DEVICE = torch.device('cpu')
+    models = build_models(config, model)
+
+    config.INPUT_SIZE = 0
+    dataset = Dataset(config, config.TEST_FLIST, config.TEST_EDGE_FLIST, config.TEST_MASK_FLIST, augment=False, training=False)
+    indices = np.random.choice(len(dataset), min(samples, len(dataset)), replace=False)
+    items = [tuple(x.unsqueeze(0) for x in dataset[index]) for index in indices]
+
+    # every calibration input is computed in fp32 before any generator is quantized,
+    # the inpainting generator sees the predicted edges it gets at test time (model 3/4)
+    calibration = {}
+    with torch.no_grad():
+        for m in models:
+            if m.name == 'EdgeModel':
+                calibration[m.name] = [(images_gray, edges, masks) for images, images_gray, edges, masks in items]
+            elif model in (3, 4):
+                calibration[m.name] = [(images, models[0](images_gray, edges, masks), masks) for images, images_gray, edges, masks in items]
+            else:
+                calibration[m.name] = [(images, edges, masks) for images, images_gray, edges, masks in items]
+
+    for m in models:
+        quantize_int8(m, calibration[m.name], m.gen_int8_path)
+        print('%s quantized to %s (%d calibration images)' % (m.name, m.gen_int8_path, len(items)))
+
+
+def drift(config, model, input, mask):
+    r"""compares the int8 and the fp32 pipelines, returns the mean PSNR and MAE of int8 against fp32"""
+    config.DEVICE = torch.device('cpu')
+    config.MODE = 2
+    config.MODEL = model
+    config.BACKEND = 'torch'
+    fp32 = InpaintEngine(config)
+    config.BACKEND = 'int8'
+    int8 = InpaintEngine(config)
+
+    config.INPUT_SIZE = 0
+    dataset = Dataset(config, input, [], mask, augment=False, training=False)
+    psnr = PSNR(255.0)
+
+    logs = []
+    for index in range(len(dataset)):
+        images, images_gray, edges, masks = (x.unsqueeze(0) for x in dataset[index])
+        target = edges if model == 1 else images
+
+        with torch.no_grad():
+            expected = fp32.forward(images, images_gray, edges, masks)
+            outputs = int8.forward(images, images_gray, edges, masks)
+
+        logs.append((
+            psnr(target * 255, expected * 255).item(),
+            psnr(target * 255, outputs * 255).item(),
+            psnr(expected * 255, outputs * 255).item(),
+            (torch.sum(torch.abs(expected - outputs)) / torch.sum(expected)).item(),
+        ))
+        print('%s psnr fp32: %.2f, psnr int8: %.2f, int8 vs fp32 psnr: %.2f, mae: %.4f' % ((dataset.load_name(index),) + logs[-1]))
+
+    logs = np.mean(logs, axis=0)
+    print('mean psnr fp32: %.2f, psnr int8: %.2f, int8 vs fp32 psnr: %.2f, mae: %.4f' % tuple(logs))
+    return logs[2], logs[3]
+
+
+def check(config, model, input, mask, format='onnx'):
+    r"""runs the pytorch and the exported (torchscript or onnx) models on the same images, returns the max absolute output difference"""
+    torch_models = build_models(config, model, 'torch')
+    exported_models = build_models(config, model, format)
+
+    config.INPUT_SIZE = 0
+    dataset = Dataset(config, input, [], mask, augment=False, training=False)
+
+    diff = 0
+    for index in range(len(dataset)):
+        images, images_gray, edges, masks = (x.unsqueeze(0).to(config.DEVICE) for x in dataset[index])
+
+        for torch_model, exported_model in zip(torch_models, exported_models):
+            inputs = images_gray if torch_model.name == 'EdgeModel' else images
+
+            with torch.no_grad():
+                expected = torch_model(inputs, edges, masks).cpu().numpy()
+                outputs = exported_model(inputs, edges, masks).cpu().numpy()
+
+            error = np.abs(outputs - expected).max()
+            diff = max(diff, error)
+            print('%s %s: max abs diff %.2e' % (dataset.load_name(index), torch_model.name, error))
+
+    return diff
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoints', type=str, default='./checkpoints/places2', help='model checkpoints path')
+    parser.add_argument('--model', type=int, default=3, choices=[1, 2, 3, 4], help='1: edge model, 2: inpaint model, 3: edge-inpaint model, 4: joint model')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu', help='device the artifact runs on (frozen graphs are device specific)')
+    parser.add_argument('--format', type=str, default='torchscript', choices=['torchscript', 'onnx', 'int8'], help='torchscript (BACKEND: torchscript), onnx (BACKEND: onnx) or int8 (BACKEND: int8)')
+    parser.add_argument('--samples', type=int, default=100, help='number of TEST_FLIST images used to calibrate int8 quantization')
+    parser.add_argument('--check', action='store_true', help='compares the exported torchscript/onnx generators with pytorch (int8: reports the PSNR/MAE drift from fp32) on --input/--mask')
+    parser.add_argument('--input', type=str, default='./examples/places2/images', help='images used by --check')
+    parser.add_argument('--mask', type=str, default='./examples/places2/masks', help='masks used by --check')
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='max abs difference (outputs in [0, 1]) accepted by --check')
+    args = parser.parse_args()
+
+    config = Config(os.path.join(args.checkpoints, 'config.yml'))
+    config.DEVICE = torch.device(args.device)
+    config.GPU = [0]
+
+    export(config, args.model, args.format, args.samples)
+
+    if args.check and args.format == 'int8':
+        drift(config, args.model, args.input, args.mask)
+
+    elif args.check:
+        # onnx graphs run with ONNX Runtime on cpu, frozen torchscript graphs on the device they were exported on
+        if args.format == 'onnx':
+            config.DEVICE = torch.device('cpu')
+        diff = check(config, args.model, args.input, args.mask, args.format)
+        print('max abs diff: %.2e (tolerance %.0e)' % (diff, args.tolerance))
+        if diff > args.tolerance:
+            sys.exit(1)
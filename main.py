@@ -7,9 +7,11 @@ import argparse
 from shutil import copyfile
 from src.config import Config
 from src.edge_connect import EdgeConnect
+from src.engine import InpaintEngine
+from src.distributed import init_distributed, is_main_process
 
 
-def main(mode, model, input, mask):    # 1: train, 2: test, 3: eval
+def main(mode=None, model=None, input=None, mask=None):    # 1: train, 2: test, 3: eval
     r"""starts the model
 
     Args:
@@ -20,30 +22,7 @@ def main(mode, model, input, mask):    # 1: train, 2: test, 3: eval
     # config = load_config2(mode, **kwargs)
     config = load_config3(mode, model, input, mask)
 
-    # cuda visble devices
-    os.environ['CUDA_VISIBLE_DEVICES'] = ','.join(str(e) for e in config.GPU)
-
-
-    # init device
-    if torch.cuda.is_available():
-        config.DEVICE = torch.device("cuda")
-        torch.backends.cudnn.benchmark = True   # cudnn auto-tuner
-    else:
-        config.DEVICE = torch.device("cpu")
-
-
-
-    # set cv2 running threads to 1 (prevents deadlocks with pytorch dataloader)
-    cv2.setNumThreads(0)
-
-
-    # initialize random seed
-    torch.manual_seed(config.SEED)
-    torch.cuda.manual_seed_all(config.SEED)
-    np.random.seed(config.SEED)
-    random.seed(config.SEED)
-
-
+    init(config)
 
     # build the model and initialize
     model = EdgeConnect(config)
@@ -52,8 +31,9 @@ def main(mode, model, input, mask):    # 1: train, 2: test, 3: eval
 
     # model training
     if config.MODE == 1:
-        config.print()
-        print('\nstart training...\n')
+        if is_main_process():
+            config.print()
+            print('\nstart training...\n')
         model.train()
 
     # model test
@@ -67,6 +47,57 @@ def main(mode, model, input, mask):    # 1: train, 2: test, 3: eval
         model.eval()
 
 
+def init(config):
+    r"""initializes the device, opencv threads and random seeds
+
+    Args:
+        config (Config): loaded model config, DEVICE is set in place
+    """
+
+    # cuda visble devices, a distributed launch (torchrun) keeps them all,
+    # every process picks the GPU of its LOCAL_RANK (see init_distributed)
+    if int(os.environ.get('WORLD_SIZE', 1)) <= 1:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ','.join(str(e) for e in config.GPU)
+
+
+    # init device, int8 generators (BACKEND: int8) have cpu kernels only
+    int8 = config.MODE == 2 and config.BACKEND == 'int8'
+    if torch.cuda.is_available() and not int8:
+        config.DEVICE = torch.device("cuda")
+        torch.backends.cudnn.benchmark = True   # cudnn auto-tuner
+    else:
+        config.DEVICE = torch.device("cpu")
+
+    # set cv2 running threads to 1 (prevents deadlocks with pytorch dataloader)
+    cv2.setNumThreads(0)
+
+
+    # distributed training (torchrun), one process per device
+    init_distributed(config)
+
+
+    # initialize random seed, every process draws different masks and augmentations
+    # (models start from rank 0's weights, see EdgeConnect.train)
+    seed = config.SEED + config.RANK
+    torch.manual_seed(seed)
+    torch.cuda.manual_seed_all(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def load_engine(model=3):
+    r"""builds the resident inference engine (loaded once, e.g. at server startup)
+
+    Args:
+        model (int): 1: edge model, 2: inpaint model, 3: edge-inpaint model, 4: joint model
+    """
+
+    config = load_config3(2, model, None, None)
+    init(config)
+
+    return InpaintEngine(config)
+
+
 def load_config(mode=None):
     r"""loads model config
 
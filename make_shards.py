@@ -0,0 +1,59 @@
+# 이미지 flist를 고정 크기 uint8 배열(.npy) 하나로 미리 변환
+# 학습 시 Dataset이 디코딩/리사이징 없이 memmap으로 바로 읽음 (TRAIN_FLIST: ./datasets/train.npy)
+#
+# python make_shards.py --checkpoints ./checkpoints/places2 --flist ./datasets/places2_train.flist --output ./datasets/places2_train.npy
+import os
+import argparse
+import numpy as np
+from multiprocessing import Pool
+from src.config import Config
+from src.dataset import Dataset
+
+
+def init_worker(d):
+    global dataset
+    dataset = d
+
+
+def load_resized(index):
+    return index, dataset.load_resized(index)
+
+
+def pack(dataset, output, workers=4):
+    r"""writes every image of the dataset, cropped and resized to INPUT_SIZE,
+    into a (N, size, size, 3) uint8 .npy and the source paths into a .flist index
+    """
+    size = dataset.input_size
+    if size == 0:
+        raise ValueError('INPUT_SIZE must be fixed (not 0) to pack a dataset')
+
+    total = len(dataset)
+    images = np.lib.format.open_memmap(output, mode='w+', dtype=np.uint8, shape=(total, size, size, 3))
+
+    with Pool(workers, initializer=init_worker, initargs=(dataset,)) as pool:
+        for count, (index, img) in enumerate(pool.imap_unordered(load_resized, range(total), chunksize=64), 1):
+            images[index] = img
+            if count % 1000 == 0:
+                print('%d/%d images packed' % (count, total))
+
+    images.flush()
+    del images
+
+    np.savetxt(os.path.splitext(output)[0] + '.flist', dataset.data, fmt='%s')
+    print('%d images packed into %s' % (total, output))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoints', type=str, default='./checkpoints/indoor', help='model checkpoints path, INPUT_SIZE is read from its config.yml')
+    parser.add_argument('--flist', type=str, help='image flist, directory or image to pack')
+    parser.add_argument('--output', type=str, help='path to the packed .npy file, the index is written next to it as .flist')
+    parser.add_argument('--size', type=int, help='overrides INPUT_SIZE')
+    parser.add_argument('--workers', type=int, default=4, help='number of decoding processes')
+    args = parser.parse_args()
+
+    config = Config(os.path.join(args.checkpoints, 'config.yml'))
+    if args.size is not None:
+        config.INPUT_SIZE = args.size
+
+    pack(Dataset(config, args.flist, [], [], augment=False, training=False), args.output, args.workers)
@@ -1,5 +1,6 @@
 import os
 import glob
+import argparse
 import numpy as np
 import cv2
 from random import randint, seed
@@ -7,6 +8,9 @@ import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.image import imread
 from PIL import Image
+from functools import partial
+from src.mask_bank import create_mask_bank
+from src.utils import create_irregular_mask
 
 
 
@@ -42,8 +46,8 @@ class MaskGenerator():
         if rand_seed:
             seed(rand_seed)
 
-    # 마스크 생성코드
-    def generate_mask(self, i):
+    # 마스크 그리기 (구멍 = 1)
+    def draw_mask(self):
         img = np.zeros((self.height, self.width), np.uint8)
 
         # Set size scale
@@ -70,16 +74,37 @@ class MaskGenerator():
             thickness = randint(3, size)
             cv2.ellipse(img, (x1, y1), (s1, s2), a1, a2, a3, (1), thickness)
 
-        img = img * 255
+        return img
+
+    # 마스크 생성코드
+    def generate_mask(self, i, path='./data/loadroom/mask'):
+        img = self.draw_mask() * 255
         im = Image.fromarray(img.astype(np.uint8))
-        im.save('./data/loadroom/mask/mask{}.png'.format(i))
+        im.save(os.path.join(path, 'mask{}.png'.format(i)))
         im.close()
 
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=27000, help='number of masks to generate')
+    parser.add_argument('--size', type=int, default=256, help='mask height and width')
+    parser.add_argument('--output', type=str, default='./data/loadroom/mask', help='directory the masks are written to as png files')
+    parser.add_argument('--bank', type=str, help='writes all masks into a single bit-packed .npy mask bank instead (e.g. ./datasets/masks_train.npy)')
+    parser.add_argument('--workers', type=int, default=4, help='number of processes drawing masks into the mask bank')
+    parser.add_argument('--irregular', action='store_true', help='draws the bank with create_irregular_mask, the masks of MASK: 7/8 (sampled from the bank instead of drawn per sample)')
+    parser.add_argument('--seed', type=int, help='random seed')
+    args = parser.parse_args()
+
+    mask = MaskGenerator(args.size, args.size, rand_seed=args.seed)
+
+    # 마스크 뱅크: 여러 프로세스가 그린 마스크를 memmap 하나에 저장 (+ 구멍 비율 인덱스)
+    if args.bank:
+        draw = partial(create_irregular_mask, args.size, args.size, 0) if args.irregular else mask.draw_mask
+        create_mask_bank(args.bank, args.count, args.size, args.size, draw, args.workers, args.seed)
 
-mask = MaskGenerator()
-for i in range(27000):
-    mask.generate_mask(i)
+    else:
+        for i in range(args.count):
+            mask.generate_mask(i, args.output)
 
 # a = np.zeros((3, 10, 10), np.uint8)
 # a = (np.random.random((10, 10, 3)) * 255.).astype(np.uint8)
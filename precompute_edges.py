@@ -0,0 +1,68 @@
+# 3단계(edge_inpaint) 학습용: 고정된 edge model의 예측 edge를 (이미지, 마스크) 쌍마다 미리 계산해 .npy(uint8)로 저장
+# 학습 시 TRAIN_EDGE_PRED에 지정하면 매 step의 edge generator forward 없이 저장된 edge로 inpainting model을 학습
+# 마스크가 이미지마다 고정되어야 함 (MASK: 6, TRAIN_MASK_FLIST가 TRAIN_FLIST와 1:1), INPUT_SIZE 고정
+#
+# python precompute_edges.py --checkpoints ./checkpoints/places2 --output ./datasets/places2_train_edges.npy
+import os
+import argparse
+import numpy as np
+import torch
+from src.config import Config
+from src.canny import Canny
+from src.dataset import Dataset
+from src.models import EdgeModel
+
+
+def precompute(config, output, batch_size=16):
+    r"""writes the merged edge model outputs for every (image, mask) pair of TRAIN_FLIST into a (N, H, W) uint8 .npy"""
+    size = config.INPUT_SIZE
+    if size == 0:
+        raise ValueError('INPUT_SIZE must be fixed (not 0) to precompute edges')
+
+    config.MASK = 6
+    dataset = Dataset(config, config.TRAIN_FLIST, config.TRAIN_EDGE_FLIST, config.TRAIN_MASK_FLIST, augment=False, training=True)
+    dataset.return_index = True
+
+    edge_model = EdgeModel(config, inference=True)
+    edge_model.load()
+    edge_model.eval()
+
+    canny = None
+    if config.EDGE == 1 and config.CANNY_BATCHED != 0:
+        canny = Canny(config.SIGMA).to(config.DEVICE)
+
+    total = len(dataset)
+    edges_pred = np.lib.format.open_memmap(output, mode='w+', dtype=np.uint8, shape=(total, size, size))
+
+    done = 0
+    for images, images_gray, edges, masks, indices in dataset.create_loader(batch_size):
+        images_gray, edges, masks = (x.to(config.DEVICE) for x in (images_gray, edges, masks))
+        if canny is not None:
+            edges = canny(images_gray)
+
+        # same merge as stage 3 training
+        with torch.no_grad():
+            outputs = edge_model(images_gray, edges, masks)
+            outputs = outputs * masks + edges * (1 - masks)
+
+        edges_pred[indices.numpy()] = (outputs[:, 0] * 255).round().byte().cpu().numpy()
+        done += len(indices)
+        print('%d/%d edge maps' % (done, total))
+
+    edges_pred.flush()
+    del edges_pred
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoints', type=str, default='./checkpoints/places2', help='model checkpoints path (EdgeModel_gen.pth and config.yml)')
+    parser.add_argument('--output', type=str, help='path to the .npy file, set TRAIN_EDGE_PRED to it')
+    parser.add_argument('--batch-size', type=int, default=16)
+    args = parser.parse_args()
+
+    config = Config(os.path.join(args.checkpoints, 'config.yml'))
+    config.MODE = 1
+    config.GPU = [0]
+    config.DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    precompute(config, args.output, args.batch_size)
@@ -0,0 +1,106 @@
+"""Incremental cache of per-image inception activations for the FID
+
+Activations are appended as float32 rows to a single memory mapped feature
+file, an index maps every image (absolute path, mtime, size and content
+hash) to its row. Only images that are new or changed since they were
+cached are run through the inception model, statistics of any subset of
+the cached images (a directory, a file list, a mask ratio bucket, ...)
+are computed from the stored rows.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+class ActivationCache():
+    """Append-only store of the activations of one inception block (dims)
+
+    Replaced images get a new row, the rows of their old content stay in
+    the feature file (and are reused if that content comes back). A single
+    process should update a cache at a time.
+    """
+
+    def __init__(self, path, dims):
+        self.dims = dims
+        self.features_path = os.path.join(path, 'features_%d.f32' % dims)
+        self.index_path = os.path.join(path, 'index_%d.json' % dims)
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self.index = {'rows': 0, 'files': {}, 'hashes': {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+        # rows appended after the index was last saved are discarded
+        with open(self.features_path, 'ab') as f:
+            f.truncate(self.index['rows'] * dims * 4)
+
+        self.pending = {}
+
+    def missing(self, files):
+        """Returns the files whose activations must be computed: files not
+        seen yet or changed (mtime or size) whose content isn't cached either"""
+        missing = []
+        for fn in files:
+            key = os.path.abspath(str(fn))
+            stat = os.stat(key)
+            entry = self.index['files'].get(key)
+            if entry is not None and entry[:2] == [stat.st_mtime_ns, stat.st_size]:
+                continue
+
+            digest = file_hash(key)
+            row = self.index['hashes'].get(digest)
+            if row is not None:
+                self.index['files'][key] = [stat.st_mtime_ns, stat.st_size, digest, row]
+                continue
+
+            self.pending[key] = [stat.st_mtime_ns, stat.st_size, digest]
+            missing.append(fn)
+
+        return missing
+
+    def add(self, files, activations):
+        """Appends the (len(files), dims) activations of files returned by missing()"""
+        activations = np.ascontiguousarray(activations, dtype=np.float32).reshape(len(files), self.dims)
+        with open(self.features_path, 'ab') as f:
+            f.write(activations.tobytes())
+
+        for fn in files:
+            key = os.path.abspath(str(fn))
+            entry = self.pending.pop(key) + [self.index['rows']]
+            self.index['files'][key] = entry
+            self.index['hashes'][entry[2]] = entry[3]
+            self.index['rows'] += 1
+
+    def save(self):
+        """Writes the index, the appended features are flushed first"""
+        with open(self.features_path, 'ab') as f:
+            os.fsync(f.fileno())
+
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+    def rows(self, files):
+        """Rows of the cached activations of files"""
+        return np.array([self.index['files'][os.path.abspath(str(fn))][3] for fn in files], dtype=np.int64)
+
+    def features(self):
+        """(rows, dims) float32 memory map of every cached activation"""
+        if self.index['rows'] == 0:
+            return np.zeros((0, self.dims), dtype=np.float32)
+
+        return np.memmap(self.features_path, dtype=np.float32, mode='r', shape=(self.index['rows'], self.dims))
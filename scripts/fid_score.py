@@ -29,19 +29,82 @@ from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
 import torch
 import numpy as np
-from scipy.misc import imread
 from scipy import linalg
-from torch.autograd import Variable
 from torch.nn.functional import adaptive_avg_pool2d
+from torch.utils.data import Dataset, DataLoader
+from PIL import Image
 
 from inception import InceptionV3
+from fid_cache import ActivationCache
 
 
 parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
-parser.add_argument('--path', type=str, nargs=2, help=('Path to the generated images or to .npz statistic files'))
+parser.add_argument('--path', type=str, nargs=2, help=('Paths to the generated images, directories or file lists (one image path per line)'))
 parser.add_argument('--batch-size', type=int, default=64, help='Batch size to use')
 parser.add_argument('--dims', type=int, default=2048, choices=list(InceptionV3.BLOCK_INDEX_BY_DIM), help=('Dimensionality of Inception features to use. By default, uses pool3 features'))
 parser.add_argument('-c', '--gpu', default='', type=str, help='GPU to use (leave blank for CPU only)')
+parser.add_argument('--workers', type=int, default=4, help='Number of image decoding worker processes')
+parser.add_argument('--cache', type=str, default=None, help=('Directory of the per-image activation cache, only new or changed images are run through the model (statistics.npz files are not used)'))
+
+
+class ImageFiles(Dataset):
+    """Images of a list of files, decoded on the data loader workers
+    as float32 (3, H, W) arrays with values between 0 and 1"""
+
+    def __init__(self, files):
+        self.files = files
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, index):
+        # grayscale, palette and RGBA files are all decoded as RGB
+        img = np.array(Image.open(str(self.files[index])).convert('RGB'))
+
+        return img.transpose((2, 0, 1)).astype(np.float32) / 255
+
+
+class RunningStatistics():
+    """Mean and covariance of activations accumulated batch by batch in
+    float64 (Chan et al. parallel update of the mean and the sum of
+    squared deviations), memory is constant in the number of samples"""
+
+    def __init__(self, dims, device=None):
+        self.n = 0
+        self.mean = torch.zeros(dims, dtype=torch.float64, device=device)
+        self.m2 = torch.zeros(dims, dims, dtype=torch.float64, device=device)
+
+    def update(self, act):
+        act = act.double()
+        n = act.shape[0]
+        if n == 0:
+            return
+
+        mean = act.mean(dim=0)
+        centered = act - mean
+        delta = mean - self.mean
+        total = self.n + n
+
+        self.mean += delta * (n / total)
+        self.m2 += centered.t() @ centered + torch.outer(delta, delta) * (self.n * n / total)
+        self.n = total
+
+    def statistics(self):
+        """Returns the mean and the (unbiased) covariance as numpy arrays"""
+        return self.mean.cpu().numpy(), (self.m2 / max(self.n - 1, 1)).cpu().numpy()
+
+
+def get_pool_activations(batch, model):
+    """Activations of the selected inception block for a (B, 3, H, W) batch,
+    spatially average pooled to (B, dims)"""
+    pred = model(batch)[0]
+
+    # If model output is not scalar, apply global spatial average pooling.
+    # This happens if you choose a dimensionality not equal 2048.
+    if pred.shape[2] != 1 or pred.shape[3] != 1:
+        pred = adaptive_avg_pool2d(pred, output_size=(1, 1))
+
+    return pred.reshape(pred.shape[0], -1)
 
 
 def get_activations(images, model, batch_size=64, dims=2048,
@@ -71,30 +134,25 @@ def get_activations(images, model, batch_size=64, dims=2048,
                'Setting batch size to data size'))
         batch_size = d0
 
-    n_batches = d0 // batch_size
-    n_used_imgs = n_batches * batch_size
+    # the last batch holds the remainder, every image is used
+    n_batches = -(-d0 // batch_size)
 
-    pred_arr = np.empty((n_used_imgs, dims))
+    pred_arr = np.empty((d0, dims))
     for i in range(n_batches):
         if verbose:
             print('\rPropagating batch %d/%d' % (i + 1, n_batches),
                   end='', flush=True)
         start = i * batch_size
-        end = start + batch_size
+        end = min(start + batch_size, d0)
 
         batch = torch.from_numpy(images[start:end]).type(torch.FloatTensor)
-        batch = Variable(batch, volatile=True)
         if cuda:
             batch = batch.cuda()
 
-        pred = model(batch)[0]
-
-        # If model output is not scalar, apply global spatial average pooling.
-        # This happens if you choose a dimensionality not equal 2048.
-        if pred.shape[2] != 1 or pred.shape[3] != 1:
-            pred = adaptive_avg_pool2d(pred, output_size=(1, 1))
+        with torch.no_grad():
+            pred = get_pool_activations(batch, model)
 
-        pred_arr[start:end] = pred.cpu().data.numpy().reshape(batch_size, -1)
+        pred_arr[start:end] = pred.cpu().numpy()
 
     if verbose:
         print(' done')
@@ -182,32 +240,122 @@ def calculate_activation_statistics(images, model, batch_size=64,
     return mu, sigma
 
 
-def _compute_statistics_of_path(path, model, batch_size, dims, cuda):
+def calculate_statistics_of_files(files, model, batch_size=64, dims=2048,
+                                  cuda=False, workers=4, verbose=False):
+    """Streaming calculation of the statistics used by the FID: images are
+    decoded by a data loader, batch by batch, and only the running mean
+    and covariance of the activations are kept in memory.
+    Params:
+    -- files       : List of image files, all of the same size
+    -- model       : Instance of inception model
+    -- batch_size  : Number of images run through the model at once, the
+                     last batch holds the remainder.
+    -- dims        : Dimensionality of features returned by Inception
+    -- cuda        : If set to True, use GPU
+    -- workers     : Number of image decoding worker processes
+    -- verbose     : If set to True, the number of calculated batches is
+                     reported.
+    Returns:
+    -- mu    : The mean over samples of the activations of the pool_3 layer of
+               the inception model.
+    -- sigma : The covariance matrix of the activations of the pool_3 layer of
+               the inception model.
+    """
+    stats = RunningStatistics(dims, 'cuda' if cuda else 'cpu')
+    for _, act in iterate_activations(files, model, batch_size, cuda, workers, verbose):
+        stats.update(act)
+
+    return stats.statistics()
+
+
+def iterate_activations(files, model, batch_size=64, cuda=False, workers=4,
+                        verbose=False):
+    """Runs the images of files through the model batch by batch, images
+    are decoded by data loader workers.
+    Returns:
+    -- A generator of (batch files, (batch size, dims) activations tensor)
+    """
+    model.eval()
+
+    loader = DataLoader(ImageFiles(files), batch_size=batch_size, num_workers=workers, pin_memory=cuda)
+
+    for i, batch in enumerate(loader):
+        if verbose:
+            print('\rPropagating batch %d/%d' % (i + 1, len(loader)),
+                  end='', flush=True)
+        if cuda:
+            batch = batch.cuda(non_blocking=True)
+
+        with torch.no_grad():
+            act = get_pool_activations(batch, model)
+
+        yield files[i * batch_size:i * batch_size + len(act)], act
+
+    if verbose:
+        print(' done')
+
+
+def calculate_statistics_of_cached_files(files, cache, model, batch_size=64,
+                                         cuda=False, workers=4):
+    """Statistics used by the FID, from the activations of an
+    ActivationCache: only the images not cached yet (new or changed) are
+    run through the model.
+    Params:
+    -- files       : List of image files, any subset of the cached images
+    -- cache       : ActivationCache of the model's dimensionality
+    Returns:
+    -- mu, sigma   : see calculate_statistics_of_files
+    """
+    missing = cache.missing(files)
+    if len(missing) > 0:
+        print('%d of %d images not cached' % (len(missing), len(files)))
+        for batch_files, act in iterate_activations(missing, model, batch_size, cuda, workers, verbose=True):
+            cache.add(batch_files, act.cpu().numpy())
+        cache.save()
+
+    # rows sorted for sequential reads of the memory map
+    rows = np.sort(cache.rows(files))
+    features = cache.features()
+    stats = RunningStatistics(cache.dims)
+    for start in range(0, len(rows), 4096):
+        stats.update(torch.from_numpy(features[rows[start:start + 4096]]))
+
+    return stats.statistics()
+
+
+def list_files(path):
+    """Images of a directory, or of a file list (one path per line, see
+    scripts/flist.py) to compute the statistics of any subset of images"""
+    if os.path.isfile(path):
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    path = pathlib.Path(path)
+    return sorted(list(path.glob('*.jpg')) + list(path.glob('*.png')))
+
+
+def _compute_statistics_of_path(path, model, batch_size, dims, cuda, workers=4, cache=None):
+    if cache is not None:
+        return calculate_statistics_of_cached_files(list_files(path), cache, model, batch_size, cuda, workers)
+
+    if os.path.isfile(path):
+        return calculate_statistics_of_files(list_files(path), model, batch_size, dims, cuda, workers, verbose=True)
+
     npz_file = os.path.join(path, 'statistics.npz')
     if os.path.exists(npz_file):
         f = np.load(npz_file)
         m, s = f['mu'][:], f['sigma'][:]
         f.close()
     else:
-        path = pathlib.Path(path)
-        files = list(path.glob('*.jpg')) + list(path.glob('*.png'))
-
-        imgs = np.array([imread(str(fn)).astype(np.float32) for fn in files])
-
-        # Bring images to shape (B, 3, H, W)
-        imgs = imgs.transpose((0, 3, 1, 2))
-
-        # Rescale images to be between 0 and 1
-        imgs /= 255
-
-        m, s = calculate_activation_statistics(imgs, model, batch_size, dims, cuda)
+        m, s = calculate_statistics_of_files(list_files(path), model, batch_size, dims, cuda, workers, verbose=True)
         np.savez(npz_file, mu=m, sigma=s)
 
     return m, s
 
 
-def calculate_fid_given_paths(paths, batch_size, cuda, dims):
-    """Calculates the FID of two paths"""
+def calculate_fid_given_paths(paths, batch_size, cuda, dims, workers=4, cache=None):
+    """Calculates the FID of two paths (directories or file lists), with
+    the activations cached in the cache directory if given"""
     for p in paths:
         if not os.path.exists(p):
             raise RuntimeError('Invalid path: %s' % p)
@@ -218,10 +366,13 @@ def calculate_fid_given_paths(paths, batch_size, cuda, dims):
     if cuda:
         model.cuda()
 
+    if cache is not None:
+        cache = ActivationCache(cache, dims)
+
     print('calculate path1 statistics...')
-    m1, s1 = _compute_statistics_of_path(paths[0], model, batch_size, dims, cuda)
+    m1, s1 = _compute_statistics_of_path(paths[0], model, batch_size, dims, cuda, workers, cache)
     print('calculate path2 statistics...')
-    m2, s2 = _compute_statistics_of_path(paths[1], model, batch_size, dims, cuda)
+    m2, s2 = _compute_statistics_of_path(paths[1], model, batch_size, dims, cuda, workers, cache)
     print('calculate frechet distance...')
     fid_value = calculate_frechet_distance(m1, s1, m2, s2)
 
@@ -235,5 +386,7 @@ if __name__ == '__main__':
     fid_value = calculate_fid_given_paths(args.path,
                                           args.batch_size,
                                           args.gpu != '',
-                                          args.dims)
+                                          args.dims,
+                                          args.workers,
+                                          args.cache)
     print('FID: ', round(fid_value, 4))
@@ -1,12 +1,11 @@
+import os
 import numpy as np
 import argparse
-import matplotlib.pyplot as plt
 
 from glob import glob
 from ntpath import basename
-from scipy.misc import imread
-from skimage.measure import compare_ssim
-from skimage.measure import compare_psnr
+from multiprocessing import Pool
+from PIL import Image
 from skimage.color import rgb2gray
 
 
@@ -15,6 +14,8 @@ def parse_args():
     parser.add_argument('--data-path', help='Path to ground truth data', type=str)
     parser.add_argument('--output-path', help='Path to output data', type=str)
     parser.add_argument('--debug', default=0, help='Debug', type=int)
+    parser.add_argument('--workers', default=os.cpu_count(), help='Number of worker processes (0: evaluate in the main process)', type=int)
+    parser.add_argument('--batch-size', default=64, help='Number of images evaluated at once by a worker', type=int)
     args = parser.parse_args()
     return args
 
@@ -22,60 +23,129 @@ def parse_args():
 def compare_mae(img_true, img_test):
     img_true = img_true.astype(np.float32)
     img_test = img_test.astype(np.float32)
-    return np.sum(np.abs(img_true - img_test)) / np.sum(img_true + img_test)
+    return np.sum(np.abs(img_true - img_test), axis=(-2, -1)) / np.sum(img_true + img_test, axis=(-2, -1))
 
 
-args = parse_args()
-for arg in vars(args):
-    print('[%s] =' % arg, getattr(args, arg))
+def compare_psnr(img_true, img_test, data_range=1):
+    r"""psnr of (..., H, W) images, same as skimage.measure.compare_psnr for each image"""
+    err = np.mean((img_true.astype(np.float64) - img_test.astype(np.float64)) ** 2, axis=(-2, -1))
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10((data_range ** 2) / err)
 
-path_true = args.data_path
-path_pred = args.output_path
 
-psnr = []
-ssim = []
-mae = []
-names = []
-index = 1
+def box_mean(img, win_size):
+    r"""means of every win_size x win_size window fully inside the (..., H, W) images, separable running sums"""
+    w = win_size
+    c = np.cumsum(img, axis=-1)
+    rows = np.concatenate((c[..., w - 1:w], c[..., w:] - c[..., :-w]), axis=-1)
+    c = np.cumsum(rows, axis=-2)
+    return np.concatenate((c[..., w - 1:w, :], c[..., w:, :] - c[..., :-w, :]), axis=-2) / (w * w)
 
-files = list(glob(path_true + '/*.jpg')) + list(glob(path_true + '/*.png'))
-for fn in sorted(files):
-    name = basename(str(fn))
-    names.append(name)
 
+def compare_ssim(img_true, img_test, data_range=1, win_size=51, K1=0.01, K2=0.03):
+    r"""mean ssim of (..., H, W) images with a uniform window, same as
+    skimage.measure.compare_ssim(img_true, img_test, data_range, win_size) for each image
+
+    skimage averages the ssim map without the (win_size - 1) / 2 pixels
+    along the borders, exactly the windows fully inside the image, so the
+    local statistics are box filtered over those windows only.
+    """
+    if min(img_true.shape[-2:]) < win_size:
+        raise ValueError('win_size (%d) exceeds the image size %s' % (win_size, img_true.shape[-2:]))
+
+    x = img_true.astype(np.float64)
+    y = img_test.astype(np.float64)
+
+    # sample covariance
+    cov_norm = win_size ** 2 / (win_size ** 2 - 1.0)
+    ux, uy = box_mean(x, win_size), box_mean(y, win_size)
+    vx = cov_norm * (box_mean(x * x, win_size) - ux * ux)
+    vy = cov_norm * (box_mean(y * y, win_size) - uy * uy)
+    vxy = cov_norm * (box_mean(x * y, win_size) - ux * uy)
+
+    C1 = (K1 * data_range) ** 2
+    C2 = (K2 * data_range) ** 2
+    S = ((2 * ux * uy + C1) * (2 * vxy + C2)) / ((ux ** 2 + uy ** 2 + C1) * (vx + vy + C2))
+    return S.mean(axis=(-2, -1))
+
+
+def imread(path):
+    return np.array(Image.open(path).convert('RGB'))
+
+
+def load(fn, path_pred):
     img_gt = (imread(str(fn)) / 255.0).astype(np.float32)
     img_pred = (imread(path_pred + '/' + basename(str(fn))) / 255.0).astype(np.float32)
 
-    img_gt = rgb2gray(img_gt)
-    img_pred = rgb2gray(img_pred)
+    return rgb2gray(img_gt), rgb2gray(img_pred)
+
+
+def evaluate(files, path_pred):
+    r"""psnr, ssim and mae of a batch of files, images of the same size are evaluated together"""
+    images = [load(fn, path_pred) for fn in files]
+
+    psnr, ssim, mae = np.zeros(len(files)), np.zeros(len(files)), np.zeros(len(files))
+    groups = {}
+    for i, (img_gt, _) in enumerate(images):
+        groups.setdefault(img_gt.shape, []).append(i)
+
+    for indices in groups.values():
+        img_gt = np.stack([images[i][0] for i in indices])
+        img_pred = np.stack([images[i][1] for i in indices])
+
+        psnr[indices] = compare_psnr(img_gt, img_pred, data_range=1)
+        ssim[indices] = compare_ssim(img_gt, img_pred, data_range=1, win_size=51)
+        mae[indices] = compare_mae(img_gt, img_pred)
+
+    return psnr, ssim, mae
+
+
+def evaluate_batch(task):
+    return evaluate(*task)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for arg in vars(args):
+        print('[%s] =' % arg, getattr(args, arg))
+
+    path_true = args.data_path
+    path_pred = args.output_path
+
+    files = sorted(list(glob(path_true + '/*.jpg')) + list(glob(path_true + '/*.png')))
+    names = [basename(str(fn)) for fn in files]
 
     if args.debug != 0:
-        plt.subplot('121')
-        plt.imshow(img_gt)
-        plt.title('Groud truth')
-        plt.subplot('122')
-        plt.imshow(img_pred)
-        plt.title('Output')
-        plt.show()
-
-    psnr.append(compare_psnr(img_gt, img_pred, data_range=1))
-    ssim.append(compare_ssim(img_gt, img_pred, data_range=1, win_size=51))
-    mae.append(compare_mae(img_gt, img_pred))
-    if np.mod(index, 100) == 0:
-        print(
-            str(index) + ' images processed',
-            "PSNR: %.4f" % round(np.mean(psnr), 4),
-            "SSIM: %.4f" % round(np.mean(ssim), 4),
-            "MAE: %.4f" % round(np.mean(mae), 4),
-        )
-    index += 1
-
-np.savez(args.output_path + '/metrics.npz', psnr=psnr, ssim=ssim, mae=mae, names=names)
-print(
-    "PSNR: %.4f" % round(np.mean(psnr), 4),
-    "PSNR Variance: %.4f" % round(np.var(psnr), 4),
-    "SSIM: %.4f" % round(np.mean(ssim), 4),
-    "SSIM Variance: %.4f" % round(np.var(ssim), 4),
-    "MAE: %.4f" % round(np.mean(mae), 4),
-    "MAE Variance: %.4f" % round(np.var(mae), 4)
-)
+        import matplotlib.pyplot as plt
+
+        for fn in files:
+            img_gt, img_pred = load(fn, path_pred)
+            plt.subplot('121')
+            plt.imshow(img_gt)
+            plt.title('Groud truth')
+            plt.subplot('122')
+            plt.imshow(img_pred)
+            plt.title('Output')
+            plt.show()
+
+    # batches of files fanned out over the worker processes, results come back in order
+    tasks = [(files[i:i + args.batch_size], path_pred) for i in range(0, len(files), args.batch_size)]
+    if args.workers > 0:
+        with Pool(args.workers) as pool:
+            results = pool.map(evaluate_batch, tasks)
+    else:
+        results = [evaluate_batch(task) for task in tasks]
+
+    psnr = np.concatenate([r[0] for r in results]) if results else np.zeros(0)
+    ssim = np.concatenate([r[1] for r in results]) if results else np.zeros(0)
+    mae = np.concatenate([r[2] for r in results]) if results else np.zeros(0)
+
+    np.savez(args.output_path + '/metrics.npz', psnr=psnr, ssim=ssim, mae=mae, names=names)
+    print(
+        "PSNR: %.4f" % round(np.mean(psnr), 4),
+        "PSNR Variance: %.4f" % round(np.var(psnr), 4),
+        "SSIM: %.4f" % round(np.mean(ssim), 4),
+        "SSIM Variance: %.4f" % round(np.var(ssim), 4),
+        "MAE: %.4f" % round(np.mean(mae), 4),
+        "MAE Variance: %.4f" % round(np.var(mae), 4)
+    )
@@ -0,0 +1,27 @@
+import os
+import argparse
+from PIL import Image
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--path', type=str, help='path to the dataset')
+args = parser.parse_args()
+
+ext = {'.JPG', '.JPEG', '.PNG', '.TIF', '.TIFF'}
+
+# converts every non-RGB image (grayscale, palette, RGBA, ...) to RGB in place, once,
+# so the data loader never has to rewrite dataset files
+converted = 0
+for root, dirs, files in os.walk(args.path):
+    print('checking ' + root)
+    for file in files:
+        if os.path.splitext(file)[1].upper() in ext:
+            path = os.path.join(root, file)
+            with Image.open(path) as img:
+                if img.mode == 'RGB':
+                    continue
+                img = img.convert('RGB')
+
+            img.save(path)
+            converted += 1
+
+print('%d images converted to RGB' % converted)
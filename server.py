@@ -1,14 +1,37 @@
 from flask import Flask
 from flask_restful import Resource, Api, reqparse
 from werkzeug.datastructures import FileStorage
-from main import main
+from concurrent.futures import ThreadPoolExecutor
+from main import load_engine
+from src.batching import BatchScheduler
 from PIL import Image
-from scipy.misc import imresize, imsave
+from src.utils import create_dir, imdecode, imencode
+import base64
 import time
 
 app = Flask(__name__)
 api = Api(app)
 
+# 서버 시작 시 모델을 한 번만 생성하고 체크포인트를 로드 (요청마다 다시 만들지 않음)
+engine = load_engine(model=3)
+# 동시에 들어온 요청들을 모아 한 번의 배치 연산으로 처리 (SERVE_BATCH_SIZE, SERVE_MAX_WAIT)
+scheduler = BatchScheduler(engine)
+create_dir('./static/results')
+
+# 입력/결과 이미지를 ./static 에 남길지 여부 (False면 디스크 쓰기 없이 응답만 반환)
+SAVE_RESULTS = True
+saver = ThreadPoolExecutor(max_workers=1)
+
+
+def save_images(*items):
+    # (이미지 배열, 저장 경로) 쌍들을 디스크에 저장
+    for img, path in items:
+        try:
+            Image.fromarray(img).save(path)
+        except Exception as e:
+            print('saving error: ' + path + ' ' + str(e))
+
+
 # /api/images 경로에 대한 연결을 처리하는 클래스
 class ImageUpload(Resource):
 
@@ -75,38 +98,33 @@ class MaskedImageUpload(Resource):
             # 마스크 이미지 파일명을 '원본파일명_mask'로 설정
             mask_name = standard_name + '_mask' + ext
 
-            # save input images
-            image_path = './static/{0}'.format(filename)
-            image.save(image_path)
-
-            # save mask image
-            mask_path = './static/{0}'.format(mask_name)
-            mask.save(mask_path)
-
-            result_path = './static/results/{0}'.format(filename)
-
-            # resize images
-            # 리사이징을 위해 Image.open으로 저장된 파일을 RGB로 연 뒤, imresize 함수를 통해 리사이징
+            # 업로드된 바이트를 메모리에서 한 번만 디코딩하고 리사이징 (디스크를 거치지 않음)
             resizes = [256, 256]
-            img_masked = Image.open(image_path).convert('RGB')
-            img_masked = imresize(img_masked, resizes)
-            imsave(image_path, img_masked)
-
-            # 마스크에 대해서도 리사이징 작업
-            img_mask = Image.open(mask_path).convert('RGB')
-            img_mask = imresize(img_mask, resizes)
-            imsave(mask_path, img_mask)
+            img_masked = imdecode(image.stream, 'RGB', resizes)
+            img_mask = imdecode(mask.stream, 'RGB', resizes)
 
-            # 딥러닝 코드 호출
-            main(mode=2, model=3, input=image_path, mask=mask_path)
+            # 배치 스케줄러에 요청을 넣고 결과를 기다림
+            result = scheduler.inpaint(img_masked, img_mask)
 
-            # 딥러닝 연산 후 성공 여부, 원본 이미지 경로, 마스크 이미지 경로, 결과 이미지 경로 리턴
-            return {
+            # 결과 이미지를 PNG로 인코딩해 응답에 바로 담음
+            response = {
                 'success': True,
-                'image': image_path,
-                'result': result_path,
-                'mask': mask_path
+                'result_data': 'data:image/png;base64,' + base64.b64encode(imencode(result, 'PNG')).decode('ascii')
             }
+
+            # 디스크 저장은 선택 사항이며, 응답을 막지 않도록 백그라운드 스레드에서 수행
+            if SAVE_RESULTS:
+                image_path = './static/{0}'.format(filename)
+                mask_path = './static/{0}'.format(mask_name)
+                result_path = './static/results/{0}'.format(filename)
+                saver.submit(save_images, (img_masked, image_path), (img_mask, mask_path), (result, result_path))
+
+                # 원본 이미지 경로, 마스크 이미지 경로, 결과 이미지 경로도 함께 리턴
+                response['image'] = image_path
+                response['result'] = result_path
+                response['mask'] = mask_path
+
+            return response
         except Exception as e:
             # 에러가 났을 경우 에러 메시지 리턴
             return {
@@ -120,4 +138,4 @@ api.add_resource(MaskedImageUpload, '/api/maskeds')
 
 if __name__ == '__main__':
     # Flask를 통해 서버 실행
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,76 @@
+import time
+import threading
+from queue import Queue, Empty
+from concurrent.futures import Future
+
+
+class BatchScheduler():
+    r"""Dynamic micro-batching in front of the resident engine
+
+    Requests are preprocessed on the caller's thread and queued. A single
+    worker thread waits at most SERVE_MAX_WAIT ms after the first queued
+    request (or until SERVE_BATCH_SIZE requests are queued), groups them by
+    resolution, runs one batched forward per group and hands every result
+    back to its waiting caller.
+    """
+
+    def __init__(self, engine, max_batch_size=None, max_wait=None):
+        self.engine = engine
+        self.max_batch_size = max(1, max_batch_size or engine.config.SERVE_BATCH_SIZE)
+        self.max_wait = (max_wait if max_wait is not None else engine.config.SERVE_MAX_WAIT) / 1000.0
+        self.queue = Queue()
+
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, image, mask):
+        r"""queues an inpainting request, returns a Future of the (H, W, 3) uint8 result"""
+        future = Future()
+
+        try:
+            item = self.engine.preprocess(image, mask)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+
+        self.queue.put((item, future))
+        return future
+
+    def inpaint(self, image, mask, timeout=None):
+        return self.submit(image, mask).result(timeout)
+
+    def loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except Empty:
+                    break
+
+            self.process(batch)
+
+    def process(self, batch):
+        # group by resolution, only same-sized tensors can be batched
+        groups = {}
+        for item, future in batch:
+            groups.setdefault(tuple(item[0].shape[2:]), []).append((item, future))
+
+        for group in groups.values():
+            futures = [future for _, future in group]
+
+            try:
+                results = self.engine.run([item for item, _ in group])
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
@@ -0,0 +1,162 @@
+import math
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from skimage.feature import canny
+
+
+class Canny(nn.Module):
+    r"""
+    Batched Canny edge detector, follows skimage.feature.canny
+    (gaussian smoothing with mask bleed-over, sobel gradients, bilinear
+    non-maximum suppression and 8-connected hysteresis) on (B, 1, H, W) tensors
+
+    Only pays off on the GPU, cpu tensors are run through skimage per sample
+    """
+
+    def __init__(self, sigma=2, low_threshold=0.1, high_threshold=0.2, truncate=4.0):
+        r"""
+        sigma: standard deviation of the gaussian filter (0: random in [1, 4] per sample, -1: no edge)
+        """
+        super(Canny, self).__init__()
+
+        self.sigma = sigma
+        self.low_threshold = low_threshold
+        self.high_threshold = high_threshold
+        self.truncate = truncate
+
+        self.register_buffer('sobel_i', torch.tensor([[-1., -2., -1.], [0., 0., 0.], [1., 2., 1.]]).view(1, 1, 3, 3))
+        self.register_buffer('sobel_j', torch.tensor([[-1., 0., 1.], [-2., 0., 2.], [-1., 0., 1.]]).view(1, 1, 3, 3))
+
+    def __call__(self, images, masks=None):
+        r"""
+        images: (B, 1, H, W) grayscale images in [0, 1]
+        masks: (B, 1, H, W) valid pixels (1) where edges are detected, None for the whole image
+        returns: (B, 1, H, W) float edge maps
+        """
+        b = images.shape[0]
+
+        # no edge
+        if self.sigma == -1:
+            return torch.zeros_like(images)
+
+        # random sigma
+        if self.sigma == 0:
+            sigma = torch.randint(1, 5, (b,)).tolist()
+        else:
+            sigma = [self.sigma] * b
+
+        if images.device.type == 'cpu':
+            return self.canny_skimage(images, sigma, masks)
+
+        with torch.no_grad():
+            return self.canny(images, sigma, masks).to(images.dtype)
+
+    def canny_skimage(self, images, sigma, masks=None):
+        # the whole image hysteresis and the large gaussian convolutions are faster in skimage on cpu
+        edges = []
+        for i in range(images.shape[0]):
+            mask = None if masks is None else masks[i, 0].numpy() > 0
+            edges.append(canny(images[i, 0].numpy(), sigma=sigma[i], mask=mask))
+
+        return torch.from_numpy(np.stack(edges)).unsqueeze(1).to(images.dtype)
+
+    def canny(self, images, sigma, masks=None):
+        sobel_i = self.sobel_i.to(images.dtype)
+        sobel_j = self.sobel_j.to(images.dtype)
+
+        # gaussian smoothing, the mask is smoothed too to renormalize what bled over from outside
+        if masks is None:
+            masks = torch.ones_like(images)
+        masks = (masks > 0).to(images.dtype)
+
+        bleed_over = self.gaussian(masks, sigma) + torch.finfo(images.dtype).eps
+        smoothed = self.gaussian(images * masks, sigma) / bleed_over
+
+        # sobel gradients (scipy.ndimage 'reflect' mode is replicate for a 1 pixel border)
+        smoothed = F.pad(smoothed, (1, 1, 1, 1), mode='replicate')
+        isobel = F.conv2d(smoothed, sobel_i)
+        jsobel = F.conv2d(smoothed, sobel_j)
+        abs_isobel = isobel.abs()
+        abs_jsobel = jsobel.abs()
+        magnitude = torch.sqrt(isobel ** 2 + jsobel ** 2)
+
+        # 3x3 erosion of the mask with a zero border wipes out the image edges
+        eroded = -F.max_pool2d(-F.pad(masks, (1, 1, 1, 1), value=0), 3, stride=1) > 0
+        eroded = eroded & (magnitude > 0)
+
+        # non-maximum suppression, the gradient direction is split into four 45 degree bins
+        # and the magnitude is interpolated between the two neighbours on each side
+        def shift(di, dj):
+            # out[i, j] = magnitude[i + di, j + dj]
+            padded = F.pad(magnitude, (1, 1, 1, 1))
+            h, w = magnitude.shape[2:]
+            return padded[:, :, 1 + di:1 + di + h, 1 + dj:1 + dj + w]
+
+        def suppress(pts, w, plus, minus):
+            c_plus = shift(*plus[1]) * w + shift(*plus[0]) * (1 - w) <= magnitude
+            c_minus = shift(*minus[1]) * w + shift(*minus[0]) * (1 - w) <= magnitude
+            return pts, c_plus & c_minus
+
+        ratio_ji = abs_jsobel / abs_isobel.clamp(min=1e-12)
+        ratio_ij = abs_isobel / abs_jsobel.clamp(min=1e-12)
+        i_ge_j = abs_isobel >= abs_jsobel
+        i_le_j = abs_isobel <= abs_jsobel
+
+        bins = [
+            # 0 to 45 degrees
+            suppress(((isobel >= 0) & (jsobel >= 0) & i_ge_j) | ((isobel <= 0) & (jsobel <= 0) & i_ge_j),
+                     ratio_ji, ((1, 0), (1, 1)), ((-1, 0), (-1, -1))),
+            # 45 to 90 degrees
+            suppress(((isobel >= 0) & (jsobel >= 0) & i_le_j) | ((isobel <= 0) & (jsobel <= 0) & i_le_j),
+                     ratio_ij, ((0, 1), (1, 1)), ((0, -1), (-1, -1))),
+            # 90 to 135 degrees
+            suppress(((isobel <= 0) & (jsobel >= 0) & i_le_j) | ((isobel >= 0) & (jsobel <= 0) & i_le_j),
+                     ratio_ij, ((0, 1), (-1, 1)), ((0, -1), (1, -1))),
+            # 135 to 180 degrees
+            suppress(((isobel <= 0) & (jsobel >= 0) & i_ge_j) | ((isobel >= 0) & (jsobel <= 0) & i_ge_j),
+                     ratio_ji, ((-1, 0), (-1, 1)), ((1, 0), (1, -1))),
+        ]
+
+        local_maxima = torch.zeros_like(eroded)
+        for pts, maxima in bins:
+            pts = pts & eroded
+            local_maxima = torch.where(pts, maxima, local_maxima)
+
+        # hysteresis: keep the 8-connected weak edges connected to a strong edge
+        low_mask = local_maxima & (magnitude >= self.low_threshold)
+        high_mask = low_mask & (magnitude >= self.high_threshold)
+
+        return self.hysteresis(low_mask, high_mask).to(images.dtype)
+
+    def hysteresis(self, low_mask, high_mask, check_every=16):
+        # grows the strong edges through the weak ones, on device; convergence is checked
+        # (one host sync) every check_every dilations only
+        low_mask = low_mask.float()
+        edges = high_mask.float()
+        for _ in range(0, low_mask.shape[2] * low_mask.shape[3], check_every):
+            previous = edges
+            for _ in range(check_every):
+                edges = F.max_pool2d(edges, 3, stride=1, padding=1) * low_mask
+            if torch.equal(edges, previous):
+                break
+
+        return edges > 0
+
+    def gaussian(self, x, sigma):
+        # separable gaussian with zero padding (scipy.ndimage 'constant' mode), one kernel per sample
+        b = x.shape[0]
+        radius = int(self.truncate * max(sigma) + 0.5)
+        kernels = []
+        for s in sigma:
+            r = torch.arange(-radius, radius + 1, dtype=x.dtype, device=x.device)
+            kernel = torch.exp(-0.5 * r ** 2 / float(s) ** 2)
+            kernel[r.abs() > int(self.truncate * s + 0.5)] = 0
+            kernels.append(kernel / kernel.sum())
+
+        kernel = torch.stack(kernels).view(b, 1, 1, -1)
+        x = x.view(1, b, *x.shape[2:])
+        x = F.conv2d(F.pad(x, (radius, radius, 0, 0)), kernel, groups=b)
+        x = F.conv2d(F.pad(x, (0, 0, radius, radius)), kernel.view(b, 1, -1, 1), groups=b)
+        return x.view(b, 1, *x.shape[2:])
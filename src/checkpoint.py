@@ -0,0 +1,168 @@
+import os
+import re
+import glob
+import atexit
+import shutil
+import threading
+from queue import Queue
+import torch
+
+
+def snapshot(state):
+    r"""copies the tensors of a (nested) state dict to cpu, later training steps can't modify the copy"""
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+
+    if isinstance(state, dict):
+        return type(state)((key, snapshot(value)) for key, value in state.items())
+
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value) for value in state)
+
+    return state
+
+
+def atomic_save(state, path):
+    r"""writes to a temporary file next to path and renames it, path always holds a complete checkpoint"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp, path)
+
+
+def atomic_copy(src, dst):
+    r"""hard links (copies on filesystems without links) src to dst, atomically"""
+    tmp = dst + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+
+    os.replace(tmp, dst)
+
+
+def load_checkpoint(path):
+    r"""loads a checkpoint on cpu, memory mapped: tensors are paged in from the file when used
+
+    Checkpoints saved in the legacy (non zip) format can't be memory mapped,
+    they are read whole (convert them with convert_checkpoints.py).
+    """
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except RuntimeError as e:
+        if 'mmap' not in str(e):
+            raise
+
+    print('%s is in the legacy format, convert it for faster loading: python convert_checkpoints.py' % path)
+    return torch.load(path, map_location='cpu')
+
+
+def convert_checkpoint(path, output=None):
+    r"""rewrites a generator checkpoint for memory mapped loading
+
+    Keeps the iteration and the generator weights only (no optimizer state),
+    as contiguous tensors that don't share storage, in the zip format.
+
+    Args:
+        path (str): *_gen.pth checkpoint
+        output (str): converted checkpoint path, path itself (atomically replaced) by default
+    """
+    data = torch.load(path, map_location='cpu')
+    state = {
+        'iteration': data.get('iteration', 0),
+        'generator': {key: value.contiguous().clone() for key, value in data['generator'].items()},
+    }
+
+    atomic_save(state, output or path)
+    return state
+
+
+def history_path(path, iteration):
+    r"""EdgeModel_gen.pth -> EdgeModel_gen_00010000.pth"""
+    root, ext = os.path.splitext(path)
+    return '%s_%08d%s' % (root, iteration, ext)
+
+
+def best_path(path):
+    r"""EdgeModel_gen.pth -> EdgeModel_gen_best.pth"""
+    root, ext = os.path.splitext(path)
+    return '%s_best%s' % (root, ext)
+
+
+def prune_history(path, keep):
+    r"""removes all but the `keep` latest history checkpoints of path"""
+    root, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(root) + r'_(\d+)' + re.escape(ext) + '$')
+
+    history = []
+    for file in glob.glob(glob.escape(root) + '_*' + ext):
+        match = pattern.match(file)
+        if match:
+            history.append((int(match.group(1)), file))
+
+    for _, file in sorted(history)[:-keep]:
+        os.remove(file)
+
+
+class CheckpointWriter():
+    r"""Writes checkpoints on a background thread
+
+    save() only snapshots the state to cpu and queues it, a single worker
+    thread writes the queued checkpoints in order. Every file is written
+    atomically (temporary file + rename), so a crash mid-write leaves the
+    previous checkpoint intact. With keep > 0 every save is also kept as an
+    iteration numbered copy, of which the `keep` latest are retained, and
+    best=True keeps a *_best copy. Pending writes are finished at exit.
+    """
+
+    def __init__(self, keep=0):
+        self.keep = keep
+        self.error = None
+        self.queue = Queue()
+
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+        atexit.register(self.wait)
+
+    def save(self, path, state, iteration=None, best=False):
+        r"""queues state to be written to path, returns once it's copied to cpu"""
+        self.check()
+        self.queue.put((path, snapshot(state), iteration, best))
+
+    def wait(self):
+        r"""blocks until every queued checkpoint is written"""
+        self.queue.join()
+        self.check()
+
+    def check(self):
+        # failed writes are raised on the training thread
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def loop(self):
+        while True:
+            path, state, iteration, best = self.queue.get()
+
+            try:
+                self.write(path, state, iteration, best)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, path, state, iteration, best):
+        atomic_save(state, path)
+
+        if self.keep > 0 and iteration is not None:
+            atomic_copy(path, history_path(path, iteration))
+            prune_history(path, self.keep)
+
+        if best:
+            atomic_copy(path, best_path(path))
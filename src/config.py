@@ -5,7 +5,7 @@ class Config(dict):
     def __init__(self, config_path):
         with open(config_path, 'r') as f:
             self._yaml = f.read()
-            self._dict = yaml.load(self._yaml)
+            self._dict = yaml.load(self._yaml, Loader=yaml.SafeLoader)
             self._dict['PATH'] = os.path.dirname(config_path)
 
     def __getattr__(self, name):
@@ -29,11 +29,25 @@ class Config(dict):
 DEFAULT_CONFIG = {
     'MODE': 1,                      # 1: train, 2: test, 3: eval
     'MODEL': 1,                     # 1: edge model, 2: inpaint model, 3: edge-inpaint model, 4: joint model
-    'MASK': 3,                      # 1: random block, 2: half, 3: external, 4: (external, random block), 5: (external, random block, half)
+    'MASK': 3,                      # 1: random block, 2: half, 3: external, 4: (external, random block), 5: (external, random block, half), 6: external (test),
+                                    # 7: irregular, 8: (irregular, random block)
+    'MASK_BANK_BINS': 0,            # mask banks only: number of hole ratio bins sampled uniformly (0: uniform over all masks)
     'EDGE': 1,                      # 1: canny, 2: external
+    'CANNY_BATCHED': 0,             # 1: canny runs on whole batches on the model device (gpu, skimage on cpu) instead of per sample in the data loader
+    'EDGE_CACHE': 0,                # size budget (MB) of the on-disk edge map cache (0: no cache)
+    'EDGE_CACHE_PATH': None,        # edge map cache directory, defaults to <checkpoints>/edge_cache
     'NMS': 1,                       # 0: no non-max-suppression, 1: applies non-max-suppression on the external edges by multiplying by Canny
     'SEED': 10,                     # random seed
     'GPU': [0],                     # list of gpu ids
+    'BACKEND': 'torch',             # torch | torchscript | onnx | int8: test mode runs the python generators or the ones exported by export.py
+    'ONNX_THREADS': 0,              # intra-op threads of the onnx runtime sessions (0: onnx runtime default)
+    'PRECISION': 'fp32',            # fp32 | fp16 | bf16: autocast precision of the networks (training and inference)
+    'TEST_BATCH_SIZE': 1,           # test mode batch size, images are batched with others of the same size
+    'TILE_SIZE': 0,                 # test mode: runs the holes in tiles of this size (0: whole image at once)
+    'TILE_OVERLAP': 32,             # overlap of neighbouring tiles, blended
+    'TILE_BATCH_SIZE': 4,           # number of tiles (or ROI crops) per forward
+    'ROI_CROP': 0,                  # test mode: 1 runs only crops around the connected components of the mask
+    'ROI_MARGIN': 0,                # context (pixels) kept around the holes by ROI_CROP (0: half the receptive field of the generators)
     'DEBUG': 0,                     # turns on debugging mode
     'VERBOSE': 0,                   # turns on verbose mode in the output console
 
@@ -45,6 +59,12 @@ DEFAULT_CONFIG = {
     'INPUT_SIZE': 256,              # input image size for training 0 for original size
     'SIGMA': 2,                     # standard deviation of the Gaussian filter used in Canny edge detector (0: random, -1: no edge)
     'MAX_ITERS': 2e6,               # maximum number of iterations to train the model
+    'DIST_BACKEND': None,           # distributed training (torchrun) process group backend: nccl | gloo (default: nccl with cuda, gloo otherwise)
+    'TRAIN_EDGE_PRED': None,        # stage 3: .npy of edges predicted offline by the frozen edge model (see precompute_edges.py)
+    'NUM_WORKERS': 0,               # number of data loading worker processes (0: load in the main process)
+    'PIN_MEMORY': 0,                # 1: copy batches into pinned memory for faster (non-blocking) transfers to the GPU
+    'PREFETCH_FACTOR': 2,           # number of batches loaded in advance by each worker
+    'PERSISTENT_WORKERS': 0,        # 1: keep worker processes alive between epochs
 
     'EDGE_THRESHOLD': 0.5,          # edge detection threshold
     'L1_LOSS_WEIGHT': 1,            # l1 loss weight
@@ -57,8 +77,13 @@ DEFAULT_CONFIG = {
     'GAN_POOL_SIZE': 0,             # fake images pool size
 
     'SAVE_INTERVAL': 1000,          # how many iterations to wait before saving model (0: never)
+    'CHECKPOINT_KEEP': 0,           # number of iteration numbered checkpoints kept besides the latest one (0: latest only)
+    'CHECKPOINT_METRIC': None,      # evaluation metric (psnr, mae, precision, ...) the *_best.pth checkpoints are kept by (None: no best checkpoint)
     'SAMPLE_INTERVAL': 1000,        # how many iterations to wait before sampling (0: never)
     'SAMPLE_SIZE': 12,              # number of images to sample
     'EVAL_INTERVAL': 0,             # how many iterations to wait before model evaluation (0: never)
     'LOG_INTERVAL': 10,             # how many iterations to wait before logging training status (0: never)
+
+    'SERVE_BATCH_SIZE': 8,          # max number of concurrent requests run in one batched forward by the server
+    'SERVE_MAX_WAIT': 10,           # max time (ms) the server waits to fill a batch after the first request arrives
 }
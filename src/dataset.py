@@ -1,25 +1,53 @@
 import os
 import glob
-import scipy
 import torch
 import random
 import numpy as np
 import torchvision.transforms.functional as F
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
 from PIL import Image
-from scipy.misc import imread
 from skimage.feature import canny
-from skimage.color import rgb2gray, gray2rgb
-from .utils import create_mask, create_irregular_mask
+from skimage.color import rgb2gray
+from .utils import create_mask, create_irregular_mask, imdecode
+from .edge_cache import EdgeCache
+from .mask_bank import MaskBank
+from .distributed import is_distributed
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
 
 
 class Dataset(torch.utils.data.Dataset):
-    def __init__(self, config, flist, edge_flist, mask_flist, augment=True, training=True):
+    def __init__(self, config, flist, edge_flist, mask_flist, augment=True, training=True, edge_pred=None):
+        r"""
+        edge_pred: .npy of precomputed edge model outputs (see precompute_edges.py), loaded instead of the edges
+        """
         super(Dataset, self).__init__()
         self.augment = augment
         self.training = training
+        self.packed = None
+
+        # packed dataset (see make_shards.py): images are read from a memory-mapped .npy,
+        # names from the .flist index written next to it
+        if isinstance(flist, str) and flist.endswith('.npy'):
+            self.packed = np.load(flist, mmap_mode='r')
+            flist = os.path.splitext(flist)[0] + '.flist'
+            if not os.path.isfile(flist):
+                raise FileNotFoundError('%s not found, the index of a packed dataset is written next to it by make_shards.py' % flist)
+
         self.data = self.load_flist(flist)
+        if self.packed is not None and len(self.data) != len(self.packed):
+            raise ValueError('%s lists %d images, the packed dataset holds %d' % (flist, len(self.data), len(self.packed)))
+
         self.edge_data = self.load_flist(edge_flist)
+
+        # mask bank (see mask_generate.py --bank): masks are sampled from a memory-mapped .npy
+        self.mask_bank = None
+        if isinstance(mask_flist, str) and mask_flist.endswith('.npy'):
+            self.mask_bank = MaskBank(mask_flist, config.MASK_BANK_BINS)
+            mask_flist = []
+
         self.mask_data = self.load_flist(mask_flist)
 
         self.input_size = config.INPUT_SIZE     # 256
@@ -27,12 +55,33 @@ class Dataset(torch.utils.data.Dataset):
         self.edge = config.EDGE                 # 1
         self.mask = config.MASK                 # 3
         self.nms = config.NMS                   # 1
+        self.canny_batched = config.CANNY_BATCHED != 0
+
+        # edge maps cached on disk, shared by the train, val and test sets
+        self.edge_cache = None
+        if config.EDGE_CACHE:
+            self.edge_cache = EdgeCache(config.EDGE_CACHE_PATH or os.path.join(config.PATH, 'edge_cache'), config.EDGE_CACHE * 1024 ** 2)
+
+        # items end with their index, so batched test outputs can be named with load_name
+        self.return_index = False
+
+        self.num_workers = config.NUM_WORKERS
+        self.pin_memory = config.PIN_MEMORY != 0
+        self.prefetch_factor = config.PREFETCH_FACTOR
+        self.persistent_workers = config.PERSISTENT_WORKERS != 0
 
         # in test mode, there's a one-to-one relationship between mask and image
         # masks are loaded non random
         if config.MODE == 2:
             self.mask = 6
 
+        # predicted edges only hold for the (image, mask) pairs they were computed on
+        self.edge_pred = None
+        if edge_pred:
+            if self.mask != 6:
+                raise ValueError('precomputed edges need one fixed mask per image (MASK: 6)')
+            self.edge_pred = np.load(edge_pred, mmap_mode='r')
+
     def __len__(self):
         return len(self.data)
 
@@ -43,43 +92,50 @@ class Dataset(torch.utils.data.Dataset):
             print('loading error: ' + self.data[index])
             item = self.load_item(0)
 
+        if self.return_index:
+            item = item + (index,)
+
         return item
 
     def load_name(self, index):
         name = self.data[index]
         return os.path.basename(name)
 
-    def load_item(self, index):
+    def load_size(self, index):
+        r"""(height, width) of the item at index, read from the image header without decoding"""
+        if self.packed is not None:
+            h, w = self.packed.shape[1:3]
+        else:
+            with Image.open(self.data[index]) as img:
+                w, h = img.size
+            h, w = h - (h % 4), w - (w % 4)
 
-        size = self.input_size                  # 256
+        if self.input_size != 0:
+            return self.input_size, self.input_size
 
-        # 이미지 변환
-        img = Image.open(self.data[index]).convert('RGB')
-        img.save(self.data[index])
+        return h, w
 
-        # load image
-        img = imread(self.data[index])          # (256, 256, 3)
+    def load_item(self, index):
 
-        # gray to rgb
-        if len(img.shape) < 3:
-            img = gray2rgb(img)
+        size = self.input_size                  # 256
 
-        # 이미지 크기 변환
-        h = img.shape[0]
-        w = img.shape[1]
-        h = h - (h % 4)
-        w = w - (w % 4)
-        img = self.resize(img, h, w)
+        # packed images are already cropped and resized, read them straight from the memory map
+        if self.packed is not None:
+            img = self.packed[index]
+            if size != 0 and img.shape[0:2] != (size, size):
+                img = resize(img, size, size)
+        else:
+            img = self.load_resized(index)              # (256, 256, 3)
 
-        # resize/crop if needed
-        if size != 0:
-            img = self.resize(img, size, size)          # (256, 256, 3)
         # create grayscale image
         img_gray = rgb2gray(img)                        # (256, 256, 3) → (256, 256)
         # load mask
         mask = self.load_mask(img, index)               # (256, 256, 3)
-        # load edge
-        edge = self.load_edge(img_gray, index, mask)    # (256, 256)
+        # load edge, or the edge model's prediction
+        if self.edge_pred is not None:
+            edge = self.edge_pred[index] / 255.
+        else:
+            edge = self.load_edge(img_gray, index, mask)    # (256, 256)
         # augment data
         if self.augment and np.random.binomial(1, 0.5) > 0:
             img = img[:, ::-1, ...]
@@ -87,37 +143,75 @@ class Dataset(torch.utils.data.Dataset):
             edge = edge[:, ::-1, ...]
             mask = mask[:, ::-1, ...]
 
-        return self.to_tensor(img), self.to_tensor(img_gray), self.to_tensor(edge), self.to_tensor(mask)
+        return to_tensor(img), to_tensor(img_gray), to_tensor(edge), to_tensor(mask)
+
+    def load_resized(self, index):
+        size = self.input_size
+
+        # load image, decoded once and converted to RGB in memory (the file is never rewritten)
+        img = self.load_image(self.data[index])
+
+        # 이미지 크기 변환
+        h = img.shape[0]
+        w = img.shape[1]
+        h = h - (h % 4)
+        w = w - (w % 4)
+        img = resize(img, h, w)
+
+        # resize/crop if needed
+        if size != 0:
+            img = resize(img, size, size)
+
+        return img
 
     def load_edge(self, img, index, mask):
         sigma = self.sigma
 
         # in test mode images are masked (with masked regions),
         # using 'mask' parameter prevents canny to detect edges for the masked regions
-        mask = None if self.training else (1 - mask / 255).astype(np.bool)
+        mask = None if self.training else (1 - mask / 255).astype(bool)
 
         # canny
         if self.edge == 1:
-            # no edge
-            if sigma == -1:
-                return np.zeros(img.shape).astype(np.float)
+            # no edge, or edges are computed on the whole batch after collation (see src/canny.py)
+            if sigma == -1 or self.canny_batched:
+                return np.zeros(img.shape).astype(np.float32)
 
             # random sigma
             if sigma == 0:
                 sigma = random.randint(1, 4)
 
-            return canny(img, sigma=sigma, mask=mask).astype(np.float)
+            if self.edge_cache is None:
+                return canny_edge(img, sigma, mask)
+
+            key = self.edge_cache.key('canny', img, sigma, mask)
+            edge = self.edge_cache.get(key)
+            if edge is None:
+                edge = canny(img, sigma=sigma, mask=mask)
+                self.edge_cache.put(key, edge)
+
+            return edge.astype(np.float32)
 
         # external
         else:
+            if self.edge_cache is not None:
+                path = self.edge_data[index]
+                key = self.edge_cache.key('external', path, os.path.getmtime(path), img, sigma, mask, self.nms)
+                edge = self.edge_cache.get(key)
+                if edge is not None:
+                    return edge
+
             imgh, imgw = img.shape[0:2]
-            edge = imread(self.edge_data[index])
-            edge = self.resize(edge, imgh, imgw)
+            edge = self.load_image(self.edge_data[index], 'L')
+            edge = resize(edge, imgh, imgw)
 
             # non-max suppression
             if self.nms == 1:
                 edge = edge * canny(img, sigma=sigma, mask=mask)
 
+            if self.edge_cache is not None:
+                self.edge_cache.put(key, edge)
+
             return edge
 
     def load_mask(self, img, index):
@@ -126,11 +220,18 @@ class Dataset(torch.utils.data.Dataset):
 
         # irregular + random block
         if mask_type == 8:
-            mask_type = 7 if np.random.binomial(1, 0.5) == 7 else 1
+            mask_type = 7 if np.random.binomial(1, 0.5) == 1 else 1
 
-        # irregular mask
+        # irregular mask, sampled from a bank drawn beforehand if any (mask_generate.py --bank --irregular)
         if mask_type == 7:
-            return create_irregular_mask(imgw, imgh, index)
+            if self.mask_bank is None:
+                return create_irregular_mask(imgw, imgh, index)
+
+            mask = self.mask_bank.sample()
+            if mask.shape[0:2] != (imgh, imgw):
+                mask = resize(mask, imgh, imgw)
+                mask = (mask > 0).astype(np.uint8) * 255
+            return mask
 
         # external + random block
         if mask_type == 4:
@@ -151,40 +252,33 @@ class Dataset(torch.utils.data.Dataset):
 
         # external
         if mask_type == 3:
-            mask_index = random.randint(0, len(self.mask_data) - 1)     # 0 ~ 마스크 개수-1
-            mask = imread(self.mask_data[mask_index])                   # 해당 인덱스 마스크 읽어오기
-            mask = self.resize(mask, imgh, imgw)                        # 256, 256으로 resizing
+            if self.mask_bank is not None:
+                mask = self.mask_bank.sample()                          # O(1), optionally stratified by hole ratio
+                if mask.shape[0:2] == (imgh, imgw):
+                    return mask
+            else:
+                mask_index = random.randint(0, len(self.mask_data) - 1)     # 0 ~ 마스크 개수-1
+                mask = self.load_image(self.mask_data[mask_index], 'L')     # 해당 인덱스 마스크 읽어오기
+
+            mask = resize(mask, imgh, imgw)                             # 256, 256으로 resizing
             mask = (mask > 0).astype(np.uint8) * 255       # threshold due to interpolation
             return mask
 
         # test mode: load mask non random
         if mask_type == 6:
-            mask = Image.open(self.data[index]).convert('RGB')
-            mask.save(self.data[index])
-            mask = imread(self.mask_data[index])
-            mask = self.resize(mask, imgh, imgw, centerCrop=False)  # (256, 256, 3)
-            mask = rgb2gray(mask)                                   # (256, 256)
-            mask = (mask > 0).astype(np.uint8) * 255
-            return mask
-
-    def to_tensor(self, img):
-        img = Image.fromarray(img)
-        img_t = F.to_tensor(img).float()
-        return img_t
-
-    def resize(self, img, height, width, centerCrop=True):
-        imgh, imgw = img.shape[0:2]
-
-        if centerCrop and imgh != imgw:
-            # center crop
-            side = np.minimum(imgh, imgw)
-            j = (imgh - side) // 2
-            i = (imgw - side) // 2
-            img = img[j:j + side, i:i + side, ...]
-
-        img = scipy.misc.imresize(img, [height, width])
-
-        return img
+            if self.mask_bank is not None:
+                mask = self.mask_bank.load(index)
+                mask = resize(mask, imgh, imgw, centerCrop=False)
+            else:
+                mask = self.load_image(self.mask_data[index])
+                mask = resize(mask, imgh, imgw, centerCrop=False)       # (256, 256, 3)
+            return threshold_mask(mask)                                 # (256, 256)
+
+    def load_image(self, path, mode='RGB'):
+        # grayscale, palette and RGBA files are all normalized to (H, W, 3) uint8,
+        # or (H, W) with mode 'L' (edges and masks)
+        # use scripts/rgb.py to convert a dataset to RGB on disk once
+        return imdecode(path, mode)
 
     def load_flist(self, flist):
         if isinstance(flist, list):     # flist가 list형이면 flist 반환
@@ -197,21 +291,145 @@ class Dataset(torch.utils.data.Dataset):
                 flist.sort()
                 return flist
 
-            if os.path.isfile(flist):   # flist파일 읽어서 배열로 생성
-                try:
-                    return np.genfromtxt(flist, dtype=np.str, encoding='utf-8')
-                except:
+            if os.path.isfile(flist):
+                # a single image
+                if os.path.splitext(flist)[1].lower() in IMAGE_EXTENSIONS:
                     return [flist]
 
+                # flist파일 읽어서 배열로 생성 (one path per line)
+                with open(flist, encoding='utf-8') as f:
+                    return [line.strip() for line in f if line.strip()]
+
         return []
 
+    def create_loader(self, batch_size, shuffle=False, drop_last=False, bucket=False, distributed=False):
+        r"""
+        bucket: batches only hold images of the same size (see BucketBatchSampler),
+        for batched inference on folders of mixed resolutions (INPUT_SIZE = 0)
+        distributed: every process of a distributed run loads its own shard (DistributedSampler),
+        call loader.sampler.set_epoch(epoch) every epoch to reshuffle
+        """
+        kwargs = {}
+
+        # decode, canny, mask loading and resizing run in worker processes
+        if self.num_workers > 0:
+            kwargs = {
+                'worker_init_fn': worker_init_fn,
+                'prefetch_factor': self.prefetch_factor,
+                'persistent_workers': self.persistent_workers,
+            }
+
+        if bucket:
+            kwargs['batch_sampler'] = BucketBatchSampler(
+                [self.load_size(index) for index in range(len(self))], batch_size, shuffle, drop_last)
+        elif distributed and is_distributed():
+            kwargs.update(batch_size=batch_size, drop_last=drop_last, sampler=DistributedSampler(self, shuffle=shuffle))
+        else:
+            kwargs.update(batch_size=batch_size, shuffle=shuffle, drop_last=drop_last)
+
+        return DataLoader(
+            dataset=self,
+            num_workers=self.num_workers,
+            pin_memory=self.pin_memory,
+            **kwargs
+        )
+
     def create_iterator(self, batch_size):
         while True:
-            sample_loader = DataLoader(
-                dataset=self,
-                batch_size=batch_size,
-                drop_last=True
-            )
+            sample_loader = self.create_loader(batch_size, drop_last=True)
 
             for item in sample_loader:
                 yield item
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    r"""Batches of indices whose items have the same size
+
+    Indices are grouped by size (in dataset order, shuffled within each size
+    if shuffle) and every group is split into batches of at most batch_size,
+    so only the last batch of each size can be smaller.
+    """
+
+    def __init__(self, sizes, batch_size, shuffle=False, drop_last=False):
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+        self.buckets = {}
+        for index, size in enumerate(sizes):
+            self.buckets.setdefault(tuple(size), []).append(index)
+
+    def __iter__(self):
+        batches = []
+        for indices in self.buckets.values():
+            if self.shuffle:
+                indices = random.sample(indices, len(indices))
+
+            for start in range(0, len(indices), self.batch_size):
+                batch = indices[start:start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+
+        if self.shuffle:
+            random.shuffle(batches)
+
+        return iter(batches)
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(len(indices) // self.batch_size for indices in self.buckets.values())
+
+        return sum(-(-len(indices) // self.batch_size) for indices in self.buckets.values())
+
+
+def worker_init_fn(worker_id):
+    # torch seeds every worker differently (base seed + worker id, new base seed every epoch),
+    # but numpy and python's random are forked with the parent's state: without this
+    # every worker would draw the same masks, sigmas and flips
+    seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def to_tensor(img):
+    img = Image.fromarray(img)
+    img_t = F.to_tensor(img).float()
+    return img_t
+
+
+def resize(img, height, width, centerCrop=True):
+    imgh, imgw = img.shape[0:2]
+
+    if centerCrop and imgh != imgw:
+        # center crop
+        side = np.minimum(imgh, imgw)
+        j = (imgh - side) // 2
+        i = (imgw - side) // 2
+        img = img[j:j + side, i:i + side, ...]
+
+    img = np.array(Image.fromarray(img).resize((width, height), Image.BILINEAR))
+
+    return img
+
+
+def threshold_mask(mask):
+    r"""(H, W) uint8 mask of a grayscale or RGB(A) one, any non-zero pixel is a hole (255)"""
+    if len(mask.shape) == 3:
+        mask = rgb2gray(mask[:, :, :3])
+
+    return (mask > 0).astype(np.uint8) * 255
+
+
+def canny_edge(img, sigma, mask=None):
+    r"""float32 canny edges of a grayscale image
+
+    sigma: -1 for no edges (zeros), 0 for a random sigma in [1, 4]
+    mask: pixels edges are detected in, None for the whole image
+    """
+    if sigma == -1:
+        return np.zeros(img.shape, dtype=np.float32)
+
+    if sigma == 0:
+        sigma = random.randint(1, 4)
+
+    return canny(img, sigma=sigma, mask=mask).astype(np.float32)
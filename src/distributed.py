@@ -0,0 +1,81 @@
+import os
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(config):
+    r"""joins the process group of a torchrun launch (WORLD_SIZE > 1), no-op otherwise
+
+    Sets config.RANK, config.WORLD_SIZE and, with cuda, moves config.DEVICE to
+    the GPU of the local rank (config.GPU is not used to select it, restrict the
+    visible GPUs with CUDA_VISIBLE_DEVICES). Every process drives a single device,
+    so config.GPU is narrowed to it (no nn.DataParallel on top).
+
+    Returns:
+        bool: True in a distributed run
+    """
+    config.RANK = 0
+    config.WORLD_SIZE = 1
+
+    if int(os.environ.get('WORLD_SIZE', 1)) <= 1:
+        return False
+
+    backend = config.DIST_BACKEND or ('nccl' if torch.cuda.is_available() else 'gloo')
+    dist.init_process_group(backend, init_method='env://')
+
+    config.RANK = dist.get_rank()
+    config.WORLD_SIZE = dist.get_world_size()
+
+    if torch.cuda.is_available():
+        local_rank = int(os.environ.get('LOCAL_RANK', 0))
+        if local_rank >= torch.cuda.device_count():
+            raise RuntimeError('LOCAL_RANK %d has no GPU, only %d visible: launch at most one process per GPU (torchrun --nproc_per_node)' % (local_rank, torch.cuda.device_count()))
+
+        torch.cuda.set_device(local_rank)
+        config.DEVICE = torch.device('cuda', local_rank)
+        config.GPU = [local_rank]
+    else:
+        config.GPU = [0]
+
+    return True
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def is_main_process():
+    r"""rank 0 saves, samples, logs and evaluates"""
+    return not is_distributed() or dist.get_rank() == 0
+
+
+def broadcast_module(module):
+    r"""copies the parameters and buffers of rank 0 to every process"""
+    if not is_distributed():
+        return
+
+    with torch.no_grad():
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            dist.broadcast(tensor, 0)
+
+
+def all_reduce_gradients(parameters):
+    r"""averages the gradients over all processes, in a single flattened all-reduce
+
+    Every process must have run the same backward, so the same parameters have gradients.
+    """
+    if not is_distributed():
+        return
+
+    grads = [p.grad for p in parameters if p.grad is not None]
+    if len(grads) == 0:
+        return
+
+    flat = torch.cat([g.reshape(-1) for g in grads])
+    dist.all_reduce(flat)
+    flat /= dist.get_world_size()
+
+    offset = 0
+    for g in grads:
+        g.copy_(flat[offset:offset + g.numel()].view_as(g))
+        offset += g.numel()
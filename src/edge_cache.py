@@ -0,0 +1,98 @@
+import os
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from .utils import create_dir
+
+
+class EdgeCache():
+    r"""Persistent on-disk LRU cache of edge maps
+
+    Entries are keyed by a hash of everything the edge map depends on (image
+    content and size, sigma, mask, ...) and stored one file per entry, binary
+    maps bit-packed. Hits refresh the file's mtime; once the cache grows past
+    max_size bytes the least recently used files are removed.
+
+    Every data loader worker keeps its own index of the directory, so the size
+    budget is approximate when several processes share a cache.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+
+        create_dir(path)
+
+        files = [f for f in os.scandir(path) if f.name.endswith('.npz')]
+        for f in sorted(files, key=lambda f: f.stat().st_mtime):
+            self.entries[f.name[:-4]] = f.stat().st_size
+            self.size += f.stat().st_size
+
+        self.evict()
+
+    def key(self, *values):
+        h = hashlib.blake2b(digest_size=16)
+        for value in values:
+            if isinstance(value, np.ndarray):
+                value = np.ascontiguousarray(value)
+                h.update(str((value.shape, value.dtype.str)).encode())
+                h.update(value.tobytes())
+            else:
+                h.update(repr(value).encode())
+            h.update(b'|')
+
+        return h.hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self.path, key + '.npz')
+        if not os.path.exists(path):
+            self.size -= self.entries.pop(key, 0)
+            return None
+
+        try:
+            with np.load(path) as data:
+                edge = data['edge']
+                if data['packed']:
+                    shape = tuple(data['shape'])
+                    edge = np.unpackbits(edge)[:int(np.prod(shape))].reshape(shape).astype(bool)
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            # evicted by another worker in the meantime
+            self.size -= self.entries.pop(key, 0)
+            return None
+
+        # entries written by other workers are picked up on their first hit
+        if key not in self.entries:
+            self.entries[key] = os.path.getsize(path)
+            self.size += self.entries[key]
+
+        self.entries.move_to_end(key)
+        return edge
+
+    def put(self, key, edge):
+        edge = np.asarray(edge)
+        packed = edge.dtype == bool
+
+        path = os.path.join(self.path, key + '.npz')
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, edge=np.packbits(edge) if packed else edge, packed=packed, shape=edge.shape)
+        os.replace(tmp_path, path)
+
+        self.size -= self.entries.pop(key, 0)
+        self.entries[key] = os.path.getsize(path)
+        self.size += self.entries[key]
+
+        self.evict()
+
+    def evict(self):
+        # least recently used first
+        while self.size > self.max_size and len(self.entries) > 1:
+            old_key, old_size = self.entries.popitem(last=False)
+            self.size -= old_size
+            try:
+                os.remove(os.path.join(self.path, old_key + '.npz'))
+            except OSError:
+                pass
@@ -1,11 +1,13 @@
 import os
 import numpy as np
 import torch
-from torch.utils.data import DataLoader
 from .dataset import Dataset
-from .models import EdgeModel, InpaintingModel
+from .models import EdgeModel, InpaintingModel, merged_forward, postprocess
 from .utils import Progbar, create_dir, stitch_images, imsave
 from .metrics import PSNR, EdgeAccuracy
+from .canny import Canny
+from .tiling import test_forward
+from .distributed import is_main_process, broadcast_module
 
 
 class EdgeConnect():
@@ -23,17 +25,29 @@ class EdgeConnect():
 
         self.debug = False
         self.model_name = model_name
-        self.edge_model = EdgeModel(config).to(config.DEVICE)
-        self.inpaint_model = InpaintingModel(config).to(config.DEVICE)
+        # test mode only needs the generators
+        # (inference generators are built on the meta device, load() maps them to config.DEVICE)
+        inference = config.MODE == 2
+        self.edge_model = EdgeModel(config, inference)
+        self.inpaint_model = InpaintingModel(config, inference)
+        if not inference:
+            self.edge_model.to(config.DEVICE)
+            self.inpaint_model.to(config.DEVICE)
 
         self.psnr = PSNR(255.0).to(config.DEVICE)
         self.edgeacc = EdgeAccuracy(config.EDGE_THRESHOLD).to(config.DEVICE)
 
+        self.canny = None
+        if config.EDGE == 1 and config.CANNY_BATCHED != 0:
+            self.canny = Canny(config.SIGMA).to(config.DEVICE)
+
         # test mode
         if self.config.MODE == 2:
             self.test_dataset = Dataset(config, config.TEST_FLIST, config.TEST_EDGE_FLIST, config.TEST_MASK_FLIST, augment=False, training=False)
         else:
-            self.train_dataset = Dataset(config, config.TRAIN_FLIST, config.TRAIN_EDGE_FLIST, config.TRAIN_MASK_FLIST, augment=True, training=True)
+            # stage 3 can train from edges predicted offline by the frozen edge model (see precompute_edges.py)
+            edge_pred = config.TRAIN_EDGE_PRED if config.MODEL == 3 else None
+            self.train_dataset = Dataset(config, config.TRAIN_FLIST, config.TRAIN_EDGE_FLIST, config.TRAIN_MASK_FLIST, augment=True, training=True, edge_pred=edge_pred)
             self.val_dataset = Dataset(config, config.VAL_FLIST, config.VAL_EDGE_FLIST, config.VAL_MASK_FLIST, augment=False, training=True)
             self.sample_iterator = self.val_dataset.create_iterator(config.SAMPLE_SIZE)
 
@@ -59,47 +73,72 @@ class EdgeConnect():
             self.edge_model.load()
             self.inpaint_model.load()
 
-    def save(self):
+    def save(self, best=False):
         if self.config.MODEL == 1:
-            self.edge_model.save()
+            self.edge_model.save(best)
 
         elif self.config.MODEL == 2 or self.config.MODEL == 3:
-            self.inpaint_model.save()
+            self.inpaint_model.save(best)
 
         else:
-            self.edge_model.save()
-            self.inpaint_model.save()
+            self.edge_model.save(best)
+            self.inpaint_model.save(best)
+
+    def improved(self, metrics):
+        r"""records the CHECKPOINT_METRIC of an evaluation, True if it's the best so far"""
+        metric = self.config.CHECKPOINT_METRIC
+        if not metric:
+            return False
+
+        if metric not in metrics:
+            raise ValueError('CHECKPOINT_METRIC %r is not evaluated by MODEL %d, expected one of %s' % (metric, self.config.MODEL, ', '.join(metrics)))
+
+        # losses and mae improve downwards, precision, recall and psnr upwards
+        value = metrics[metric]
+        best = (self.edge_model if self.config.MODEL == 1 else self.inpaint_model).best
+        lower = metric == 'mae' or metric.startswith('l_')
+        if best is not None and (value >= best if lower else value <= best):
+            return False
+
+        self.edge_model.best = self.inpaint_model.best = value
+        return True
 
     def train(self):
-        train_loader = DataLoader(
-            dataset=self.train_dataset,
-            batch_size=self.config.BATCH_SIZE,
-            num_workers=0,
-            drop_last=True,
-            shuffle=True
-        )
+        # in a distributed run every process loads its own shard, rank 0 alone saves, samples, logs and evaluates
+        train_loader = self.train_dataset.create_loader(self.config.BATCH_SIZE, shuffle=True, drop_last=True, distributed=True)
+        main_process = is_main_process()
 
         epoch = 0
         keep_training = True
         model = self.config.MODEL
         max_iteration = int(float((self.config.MAX_ITERS)))
-        total = len(self.train_dataset)
+        total = len(train_loader.sampler)
 
         if total == 0:
             print('No training data was provided! Check \'TRAIN_FLIST\' value in the configuration file.')
             return
 
+        # all processes start from the weights of rank 0
+        broadcast_module(self.edge_model)
+        broadcast_module(self.inpaint_model)
+
         while(keep_training):
             epoch += 1
-            print('\n\nTraining epoch: %d' % epoch)
+            if main_process:
+                print('\n\nTraining epoch: %d' % epoch)
+
+            if hasattr(train_loader.sampler, 'set_epoch'):
+                train_loader.sampler.set_epoch(epoch)
 
-            progbar = Progbar(total, width=20, stateful_metrics=['epoch', 'iter'])
+            progbar = Progbar(total, width=20, verbose=int(main_process), stateful_metrics=['epoch', 'iter'])
 
             for items in train_loader:
-                self.edge_model.train()
+                # the edge model is frozen in stage 3
+                self.edge_model.train(model != 3)
                 self.inpaint_model.train()
 
                 images, images_gray, edges, masks = self.cuda(*items)   # (8, 3, 256, 256), (8, 1, 256, 256), (8, 1, 256, 256), (8, 1, 256, 256)
+                edges = self.load_edge(self.train_dataset, images_gray, edges, masks)
 
                 # edge model
                 if model == 1:
@@ -123,7 +162,7 @@ class EdgeConnect():
                     outputs_merged = (outputs * masks) + (images * (1 - masks))
 
                     # metrics
-                    psnr = self.psnr(self.postprocess(images), self.postprocess(outputs_merged))
+                    psnr = self.psnr(postprocess(images), postprocess(outputs_merged))
                     mae = (torch.sum(torch.abs(images - outputs_merged)) / torch.sum(images)).float()
                     logs.append(('psnr', psnr.item()))
                     logs.append(('mae', mae.item()))
@@ -135,18 +174,20 @@ class EdgeConnect():
 
                 # inpaint with edge model
                 elif model == 3:
-                    # train
-                    if True or np.random.binomial(1, 0.5) > 0:
-                        outputs = self.edge_model(images_gray, edges, masks)
-                        outputs = outputs * masks + edges * (1 - masks)
-                    else:
+                    # train, the frozen edge model runs without autograd, or not at all
+                    # when its predictions were precomputed (TRAIN_EDGE_PRED)
+                    if self.train_dataset.edge_pred is not None:
                         outputs = edges
+                    else:
+                        with torch.no_grad():
+                            outputs = self.edge_model(images_gray, edges, masks)
+                            outputs = outputs * masks + edges * (1 - masks)
 
-                    outputs, gen_loss, dis_loss, logs = self.inpaint_model.process(images, outputs.detach(), masks)
+                    outputs, gen_loss, dis_loss, logs = self.inpaint_model.process(images, outputs, masks)
                     outputs_merged = (outputs * masks) + (images * (1 - masks))
 
                     # metrics
-                    psnr = self.psnr(self.postprocess(images), self.postprocess(outputs_merged))
+                    psnr = self.psnr(postprocess(images), postprocess(outputs_merged))
                     mae = (torch.sum(torch.abs(images - outputs_merged)) / torch.sum(images)).float()
                     logs.append(('psnr', psnr.item()))
                     logs.append(('mae', mae.item()))
@@ -165,7 +206,7 @@ class EdgeConnect():
                     outputs_merged = (i_outputs * masks) + (images * (1 - masks))
 
                     # metrics
-                    psnr = self.psnr(self.postprocess(images), self.postprocess(outputs_merged))
+                    psnr = self.psnr(postprocess(images), postprocess(outputs_merged))
                     mae = (torch.sum(torch.abs(images - outputs_merged)) / torch.sum(images)).float()
                     precision, recall = self.edgeacc(edges * masks, e_outputs * masks)
                     e_logs.append(('pre', precision.item()))
@@ -191,6 +232,9 @@ class EdgeConnect():
 
                 progbar.add(len(images), values=logs if self.config.VERBOSE else [x for x in logs if not x[0].startswith('l_')])
 
+                if not main_process:
+                    continue
+
                 # log model at checkpoints
                 if self.config.LOG_INTERVAL and iteration % self.config.LOG_INTERVAL == 0:
                     self.log(logs)
@@ -200,23 +244,32 @@ class EdgeConnect():
                     self.sample()
 
                 # evaluate model at checkpoints
+                best = False
                 if self.config.EVAL_INTERVAL and iteration % self.config.EVAL_INTERVAL == 0:
                     print('\nstart eval...\n')
-                    self.eval()
+                    best = self.improved(self.eval())
 
-                # save model at checkpoints
-                if self.config.SAVE_INTERVAL and iteration % self.config.SAVE_INTERVAL == 0:
-                    self.save()
+                # save model at checkpoints, and whenever it evaluates best
+                if best or (self.config.SAVE_INTERVAL and iteration % self.config.SAVE_INTERVAL == 0):
+                    self.save(best)
+
+        # pending checkpoint writes
+        self.edge_model.checkpoints.wait()
+        self.inpaint_model.checkpoints.wait()
 
         print('\nEnd training....')
 
     def eval(self):
-        val_loader = DataLoader(
-            dataset=self.val_dataset,
-            batch_size=self.config.BATCH_SIZE,
-            drop_last=True,
-            shuffle=True
-        )
+        # process() counts iterations, eval must not advance them (in a distributed run,
+        # only rank 0 evaluates and the iteration counters must stay in step)
+        iterations = self.edge_model.iteration, self.inpaint_model.iteration
+        try:
+            return self._eval()
+        finally:
+            self.edge_model.iteration, self.inpaint_model.iteration = iterations
+
+    def _eval(self):
+        val_loader = self.val_dataset.create_loader(self.config.BATCH_SIZE, shuffle=True, drop_last=True)
 
         model = self.config.MODEL
         total = len(self.val_dataset)
@@ -226,10 +279,12 @@ class EdgeConnect():
 
         progbar = Progbar(total, width=20, stateful_metrics=['it'])
         iteration = 0
+        metrics = {}
 
         for items in val_loader:
             iteration += 1
             images, images_gray, edges, masks = self.cuda(*items)
+            edges = self.load_edge(self.val_dataset, images_gray, edges, masks)
 
             # edge model
             if model == 1:
@@ -249,7 +304,7 @@ class EdgeConnect():
                 outputs_merged = (outputs * masks) + (images * (1 - masks))
 
                 # metrics
-                psnr = self.psnr(self.postprocess(images), self.postprocess(outputs_merged))
+                psnr = self.psnr(postprocess(images), postprocess(outputs_merged))
                 mae = (torch.sum(torch.abs(images - outputs_merged)) / torch.sum(images)).float()
                 logs.append(('psnr', psnr.item()))
                 logs.append(('mae', mae.item()))
@@ -265,7 +320,7 @@ class EdgeConnect():
                 outputs_merged = (outputs * masks) + (images * (1 - masks))
 
                 # metrics
-                psnr = self.psnr(self.postprocess(images), self.postprocess(outputs_merged))
+                psnr = self.psnr(postprocess(images), postprocess(outputs_merged))
                 mae = (torch.sum(torch.abs(images - outputs_merged)) / torch.sum(images)).float()
                 logs.append(('psnr', psnr.item()))
                 logs.append(('mae', mae.item()))
@@ -280,7 +335,7 @@ class EdgeConnect():
                 outputs_merged = (i_outputs * masks) + (images * (1 - masks))
 
                 # metrics
-                psnr = self.psnr(self.postprocess(images), self.postprocess(outputs_merged))
+                psnr = self.psnr(postprocess(images), postprocess(outputs_merged))
                 mae = (torch.sum(torch.abs(images - outputs_merged)) / torch.sum(images)).float()
                 precision, recall = self.edgeacc(edges * masks, e_outputs * masks)
                 e_logs.append(('pre', precision.item()))
@@ -289,10 +344,15 @@ class EdgeConnect():
                 i_logs.append(('mae', mae.item()))
                 logs = e_logs + i_logs
 
+            for name, value in logs:
+                metrics[name] = metrics.get(name, 0) + value
 
             logs = [("it", iteration), ] + logs
             progbar.add(len(images), values=logs)
 
+        # mean of every metric over the validation batches
+        return {name: value / max(iteration, 1) for name, value in metrics.items()}
+
     def test(self):
         self.edge_model.eval()
         self.inpaint_model.eval()
@@ -300,49 +360,45 @@ class EdgeConnect():
         model = self.config.MODEL
         create_dir(self.results_path)
 
-        test_loader = DataLoader(
-            dataset=self.test_dataset,
-            batch_size=1,
-        )
+        # images are batched with others of the same size, items carry their index for naming
+        self.test_dataset.return_index = True
+        test_loader = self.test_dataset.create_loader(self.config.TEST_BATCH_SIZE, bucket=True)
 
-        index = 0
         for items in test_loader:
-            name = self.test_dataset.load_name(index)
-            images, images_gray, edges, masks = self.cuda(*items)
-            index += 1
+            images, images_gray, edges, masks = self.cuda(*items[:4])
+            edges = self.load_edge(self.test_dataset, images_gray, edges, masks)
 
-            # edge model
-            if model == 1:
-                outputs = self.edge_model(images_gray, edges, masks)
-                outputs_merged = (outputs * masks) + (edges * (1 - masks))
+            with torch.no_grad():
+                outputs_merged = test_forward(
+                    self.forward, (images, images_gray, edges, masks), edges if model == 1 else images,
+                    self.config)
 
-            # inpaint model
-            elif model == 2:
-                outputs = self.inpaint_model(images, edges, masks)
-                outputs_merged = (outputs * masks) + (images * (1 - masks))
+                # predicted edges
+                if self.debug and model >= 3:
+                    edges = self.edge_model(images_gray, edges, masks)
 
-            # inpaint with edge model / joint model
-            else:
-                edges = self.edge_model(images_gray, edges, masks).detach()
-                outputs = self.inpaint_model(images, edges, masks)
-                outputs_merged = (outputs * masks) + (images * (1 - masks))
+            outputs = postprocess(outputs_merged)
+            for i, index in enumerate(items[4].tolist()):
+                name = self.test_dataset.load_name(index)
+                path = os.path.join(self.results_path, name)
+                print(index + 1, name)
 
-            output = self.postprocess(outputs_merged)[0]
-            path = os.path.join(self.results_path, name)
-            print(index, name)
+                imsave(outputs[i], path)
 
-            imsave(output, path)
+                if self.debug:
+                    edge = postprocess(1 - edges)[i]
+                    masked = postprocess(images * (1 - masks) + masks)[i]
+                    fname, fext = name.split('.')
 
-            if self.debug:
-                edges = self.postprocess(1 - edges)[0]
-                masked = self.postprocess(images * (1 - masks) + masks)[0]
-                fname, fext = name.split('.')
-
-                imsave(edges, os.path.join(self.results_path, fname + '_edge.' + fext))
-                imsave(masked, os.path.join(self.results_path, fname + '_masked.' + fext))
+                    imsave(edge, os.path.join(self.results_path, fname + '_edge.' + fext))
+                    imsave(masked, os.path.join(self.results_path, fname + '_masked.' + fext))
 
         print('\nEnd test....')
 
+    def forward(self, images, images_gray, edges, masks):
+        r"""test mode forward of the configured MODEL, returns the outputs merged with the known pixels"""
+        return merged_forward(self.config.MODEL, self.edge_model, self.inpaint_model, images, images_gray, edges, masks)
+
     def sample(self, it=None):
         # do not sample when validation set is empty
         if len(self.val_dataset) == 0:
@@ -354,6 +410,7 @@ class EdgeConnect():
         model = self.config.MODEL
         items = next(self.sample_iterator)
         images, images_gray, edges, masks = self.cuda(*items)
+        edges = self.load_edge(self.val_dataset, images_gray, edges, masks)
 
         # edge model
         if model == 1:
@@ -386,11 +443,11 @@ class EdgeConnect():
             image_per_row = 1
 
         images = stitch_images(
-            self.postprocess(images),
-            self.postprocess(inputs),
-            self.postprocess(edges),
-            self.postprocess(outputs),
-            self.postprocess(outputs_merged),
+            postprocess(images),
+            postprocess(inputs),
+            postprocess(edges),
+            postprocess(outputs),
+            postprocess(outputs_merged),
             img_per_row = image_per_row
         )
 
@@ -405,11 +462,13 @@ class EdgeConnect():
         with open(self.log_file, 'a') as f:
             f.write('%s\n' % ' '.join([str(item[1]) for item in logs]))
 
-    def cuda(self, *args):
-        return (item.to(self.config.DEVICE) for item in args)
+    def load_edge(self, dataset, images_gray, edges, masks):
+        # batched canny on the collated batch, replaces the placeholder edges from the data loader
+        if self.canny is not None and dataset.edge_pred is None:
+            edges = self.canny(images_gray, None if dataset.training else 1 - masks)
+
+        return edges
 
-    def postprocess(self, img):
-        # [0, 1] => [0, 255]
-        img = img * 255.0
-        img = img.permute(0, 2, 3, 1)
-        return img.int()
+    def cuda(self, *args):
+        non_blocking = self.config.PIN_MEMORY != 0
+        return (item.to(self.config.DEVICE, non_blocking=non_blocking) for item in args)
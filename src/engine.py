@@ -0,0 +1,109 @@
+import numpy as np
+import torch
+from PIL import Image
+from skimage.color import rgb2gray
+from .canny import Canny
+from .dataset import to_tensor, threshold_mask, canny_edge
+from .models import EdgeModel, InpaintingModel, merged_forward, postprocess
+from .tiling import test_forward
+
+
+class InpaintEngine():
+    r"""Resident inference engine
+
+    Builds the edge and inpainting generators once (no discriminators,
+    optimizers or VGG losses), loads their checkpoints and keeps them in eval
+    mode, so every request only pays for the forward pass.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+        # load() maps the checkpoints and moves the generators to config.DEVICE,
+        # the generators MODEL doesn't use are never allocated
+        self.edge_model = EdgeModel(config, inference=True)
+        self.inpaint_model = InpaintingModel(config, inference=True)
+
+        if config.MODEL == 1:
+            self.edge_model.load()
+        elif config.MODEL == 2:
+            self.inpaint_model.load()
+        else:
+            self.edge_model.load()
+            self.inpaint_model.load()
+
+        self.edge_model.eval()
+        self.inpaint_model.eval()
+
+        self.canny = None
+        if config.EDGE == 1 and config.CANNY_BATCHED != 0:
+            self.canny = Canny(config.SIGMA).to(config.DEVICE)
+
+    def inpaint(self, image, mask):
+        r"""inpaints a single image in memory
+
+        Args:
+            image (np.ndarray): (H, W, 3) or (H, W) uint8 masked image
+            mask (np.ndarray): (H, W, 3) or (H, W) uint8 mask, non-zero pixels are holes
+
+        Returns:
+            np.ndarray: (H', W', 3) uint8 result, H' and W' cropped to a multiple of 4
+        """
+        return self.run([self.preprocess(image, mask)])[0]
+
+    def run(self, items):
+        r"""runs one batched forward over preprocessed items of the same size
+
+        Args:
+            items (list): tuples of (images, images_gray, edges, masks) as returned by preprocess
+
+        Returns:
+            list: (H, W, 3) uint8 results, in the order of items
+        """
+        images, images_gray, edges, masks = (torch.cat(item).to(self.config.DEVICE) for item in zip(*items))
+
+        if self.canny is not None:
+            edges = self.canny(images_gray, 1 - masks)
+
+        with torch.no_grad():
+            outputs = test_forward(
+                self.forward, (images, images_gray, edges, masks), edges if self.config.MODEL == 1 else images,
+                self.config)
+
+        outputs = postprocess(outputs).cpu().numpy().astype(np.uint8)
+        return list(outputs)
+
+    def preprocess(self, image, mask):
+        r"""converts an image and its mask into (1, C, H, W) cpu tensors"""
+        image = np.asarray(image)
+        mask = np.asarray(mask)
+
+        if len(image.shape) < 3:
+            image = np.stack((image,) * 3, axis=-1)
+
+        # the generators downsample twice, crop to a multiple of 4
+        h, w = image.shape[0:2]
+        h, w = h - (h % 4), w - (w % 4)
+        image = image[:h, :w, :3]
+
+        if mask.shape[0:2] != (h, w):
+            mask = np.array(Image.fromarray(mask).resize((w, h), Image.NEAREST))
+
+        mask = threshold_mask(mask)
+
+        # edges are detected outside the holes only, on the whole batch in run() with CANNY_BATCHED
+        image_gray = rgb2gray(image)
+        if self.canny is not None:
+            edge = np.zeros(image_gray.shape, dtype=np.float32)
+        else:
+            edge = canny_edge(image_gray, self.config.SIGMA, (1 - mask / 255).astype(bool))
+
+        return (
+            to_tensor(image).unsqueeze(0),
+            to_tensor(image_gray).unsqueeze(0),
+            to_tensor(edge).unsqueeze(0),
+            to_tensor(mask).unsqueeze(0),
+        )
+
+    def forward(self, images, images_gray, edges, masks):
+        return merged_forward(self.config.MODEL, self.edge_model, self.inpaint_model, images, images_gray, edges, masks)
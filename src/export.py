@@ -0,0 +1,106 @@
+import torch
+import torch.nn as nn
+from torch.nn.utils.spectral_norm import SpectralNorm
+from .networks import EdgeGenerator
+
+
+def unwrap(module):
+    r"""returns the module wrapped by nn.DataParallel, if any"""
+    if isinstance(module, nn.DataParallel):
+        return module.module
+
+    return module
+
+
+def fold_spectral_norm(module):
+    r"""removes every spectral norm hook in place, the normalized weights become plain parameters"""
+    for m in module.modules():
+        for hook in list(m._forward_pre_hooks.values()):
+            if isinstance(hook, SpectralNorm):
+                nn.utils.remove_spectral_norm(m, hook.name)
+
+    return module
+
+
+def export_torchscript(model, path):
+    r"""scripts and freezes the generator of an inference model into a standalone artifact
+
+    Spectral norm is folded into the conv weights, the weights are converted to
+    channels-last and inlined as constants, so loading the artifact needs no
+    module construction and the forward runs no spectral norm hooks. The
+    frozen graph is tied to the device the model is on.
+
+    Args:
+        model (BaseModel): model built with inference=True, checkpoint loaded
+        path (str): output path of the scripted generator (.pt)
+    """
+    generator = fold_spectral_norm(unwrap(model.generator)).eval()
+    generator = generator.to(memory_format=torch.channels_last)
+
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.script(generator))
+
+    torch.jit.save(scripted, path)
+    return scripted
+
+
+def export_onnx(model, path, opset_version=17):
+    r"""exports the forward of an inference model, masking included, as an ONNX graph
+
+    Spectral norm is folded into the conv weights first. Batch size, height
+    and width are dynamic (height and width must stay multiples of 4).
+
+    Args:
+        model (BaseModel): model built with inference=True, checkpoint loaded
+        path (str): output path of the graph (.onnx)
+    """
+    fold_spectral_norm(unwrap(model.generator))
+    model = model.cpu().eval()
+
+    # (grayscale(1) | rgb(3), edge(1), mask(1))
+    channels = 1 if isinstance(unwrap(model.generator), EdgeGenerator) else 3
+    inputs = (torch.zeros(1, channels, 64, 64), torch.zeros(1, 1, 64, 64), torch.zeros(1, 1, 64, 64))
+    axes = {0: 'batch', 2: 'height', 3: 'width'}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model, inputs, path,
+            input_names=['images', 'edges', 'masks'],
+            output_names=['outputs'],
+            dynamic_axes={'images': axes, 'edges': axes, 'masks': axes, 'outputs': axes},
+            opset_version=opset_version
+        )
+
+
+def quantize_int8(model, calibration, path):
+    r"""post-training static int8 quantization of the generator of an inference model
+
+    Spectral norm is folded, observers are inserted in the encoder, middle and
+    decoder (FX graph mode) and calibrated by running model.forward on the
+    calibration batches, the quantized generator is then scripted and frozen.
+    Quantized kernels run on cpu only (torch.backends.quantized.engine).
+
+    Args:
+        model (BaseModel): model built with inference=True, checkpoint loaded
+        calibration (iterable): batches of (images, edges, masks) cpu tensors fed to model.forward
+        path (str): output path of the quantized generator (.pt)
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    generator = fold_spectral_norm(unwrap(model.generator)).eval()
+    model = model.cpu().eval()
+
+    example_inputs = (torch.zeros(1, generator.encoder[1].in_channels, 64, 64),)
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    model.generator = prepare_fx(generator, qconfig_mapping, example_inputs=example_inputs)
+
+    with torch.no_grad():
+        for images, edges, masks in calibration:
+            model(images, edges, masks)
+
+        model.generator = convert_fx(model.generator)
+        scripted = torch.jit.freeze(torch.jit.script(model.generator))
+
+    torch.jit.save(scripted, path)
+    return scripted
@@ -50,22 +50,29 @@ class StyleLoss(nn.Module):
     https://github.com/dxyang/StyleTransfer/blob/master/utils.py
     """
 
-    def __init__(self):
+    def __init__(self, vgg=None):
+        r"""
+        vgg: feature extractor shared with other losses, a new VGG19 is built if None
+        """
         super(StyleLoss, self).__init__()
-        self.add_module('vgg', VGG19())
+        self.add_module('vgg', vgg if vgg is not None else VGG19(last_layer='relu5_2'))
         self.criterion = torch.nn.L1Loss()
 
     def compute_gram(self, x):
-        b, ch, h, w = x.size()
-        f = x.view(b, ch, w * h)
-        f_T = f.transpose(1, 2)
-        G = f.bmm(f_T) / (h * w * ch)
+        # always in fp32, the sums overflow in half precision
+        with torch.autocast(x.device.type, enabled=False):
+            b, ch, h, w = x.size()
+            f = x.float().view(b, ch, w * h)
+            f_T = f.transpose(1, 2)
+            G = f.bmm(f_T) / (h * w * ch)
 
         return G
 
     def __call__(self, x, y):
-        # Compute features
-        x_vgg, y_vgg = self.vgg(x), self.vgg(y)
+        # Compute features, the target doesn't need a graph
+        x_vgg = self.vgg(x)
+        with torch.no_grad():
+            y_vgg = self.vgg(y)
 
         # Compute loss
         style_loss = 0.0
@@ -85,15 +92,20 @@ class PerceptualLoss(nn.Module):
     https://github.com/dxyang/StyleTransfer/blob/master/utils.py
     """
 
-    def __init__(self, weights=[1.0, 1.0, 1.0, 1.0, 1.0]):
+    def __init__(self, weights=[1.0, 1.0, 1.0, 1.0, 1.0], vgg=None):
+        r"""
+        vgg: feature extractor shared with other losses, a new VGG19 is built if None
+        """
         super(PerceptualLoss, self).__init__()
-        self.add_module('vgg', VGG19())
+        self.add_module('vgg', vgg if vgg is not None else VGG19(last_layer='relu5_1'))
         self.criterion = torch.nn.L1Loss()
         self.weights = weights
 
     def __call__(self, x, y):
-        # Compute features
-        x_vgg, y_vgg = self.vgg(x), self.vgg(y)
+        # Compute features, the target doesn't need a graph
+        x_vgg = self.vgg(x)
+        with torch.no_grad():
+            y_vgg = self.vgg(y)
 
         content_loss = 0.0
         content_loss += self.weights[0] * self.criterion(x_vgg['relu1_1'], y_vgg['relu1_1'])
@@ -108,124 +120,42 @@ class PerceptualLoss(nn.Module):
 
 
 class VGG19(torch.nn.Module):
-    def __init__(self):
+    # (name, first, last + 1) of the torchvision vgg19 feature layers ending at each relu
+    LAYERS = [
+        ('relu1_1', 0, 2), ('relu1_2', 2, 4),
+        ('relu2_1', 4, 7), ('relu2_2', 7, 9),
+        ('relu3_1', 9, 12), ('relu3_2', 12, 14), ('relu3_3', 14, 16), ('relu3_4', 16, 18),
+        ('relu4_1', 18, 21), ('relu4_2', 21, 23), ('relu4_3', 23, 25), ('relu4_4', 25, 27),
+        ('relu5_1', 27, 30), ('relu5_2', 30, 32), ('relu5_3', 32, 34), ('relu5_4', 34, 36),
+    ]
+
+    def __init__(self, last_layer='relu5_4'):
+        r"""
+        last_layer: deepest feature needed, the layers after it are neither built nor run
+        """
         super(VGG19, self).__init__()
         features = models.vgg19(pretrained=True).features
-        self.relu1_1 = torch.nn.Sequential()
-        self.relu1_2 = torch.nn.Sequential()
-
-        self.relu2_1 = torch.nn.Sequential()
-        self.relu2_2 = torch.nn.Sequential()
-
-        self.relu3_1 = torch.nn.Sequential()
-        self.relu3_2 = torch.nn.Sequential()
-        self.relu3_3 = torch.nn.Sequential()
-        self.relu3_4 = torch.nn.Sequential()
-
-        self.relu4_1 = torch.nn.Sequential()
-        self.relu4_2 = torch.nn.Sequential()
-        self.relu4_3 = torch.nn.Sequential()
-        self.relu4_4 = torch.nn.Sequential()
-
-        self.relu5_1 = torch.nn.Sequential()
-        self.relu5_2 = torch.nn.Sequential()
-        self.relu5_3 = torch.nn.Sequential()
-        self.relu5_4 = torch.nn.Sequential()
-
-        for x in range(2):
-            self.relu1_1.add_module(str(x), features[x])
-
-        for x in range(2, 4):
-            self.relu1_2.add_module(str(x), features[x])
 
-        for x in range(4, 7):
-            self.relu2_1.add_module(str(x), features[x])
+        self.names = []
+        for name, first, last in self.LAYERS:
+            layer = torch.nn.Sequential()
+            for x in range(first, last):
+                layer.add_module(str(x), features[x])
 
-        for x in range(7, 9):
-            self.relu2_2.add_module(str(x), features[x])
+            self.add_module(name, layer)
+            self.names.append(name)
 
-        for x in range(9, 12):
-            self.relu3_1.add_module(str(x), features[x])
-
-        for x in range(12, 14):
-            self.relu3_2.add_module(str(x), features[x])
-
-        for x in range(14, 16):
-            self.relu3_3.add_module(str(x), features[x])
-
-        for x in range(16, 18):
-            self.relu3_4.add_module(str(x), features[x])
-
-        for x in range(18, 21):
-            self.relu4_1.add_module(str(x), features[x])
-
-        for x in range(21, 23):
-            self.relu4_2.add_module(str(x), features[x])
-
-        for x in range(23, 25):
-            self.relu4_3.add_module(str(x), features[x])
-
-        for x in range(25, 27):
-            self.relu4_4.add_module(str(x), features[x])
-
-        for x in range(27, 30):
-            self.relu5_1.add_module(str(x), features[x])
-
-        for x in range(30, 32):
-            self.relu5_2.add_module(str(x), features[x])
-
-        for x in range(32, 34):
-            self.relu5_3.add_module(str(x), features[x])
-
-        for x in range(34, 36):
-            self.relu5_4.add_module(str(x), features[x])
+            if name == last_layer:
+                break
 
         # don't need the gradients, just want the features
         for param in self.parameters():
             param.requires_grad = False
 
     def forward(self, x):
-        relu1_1 = self.relu1_1(x)
-        relu1_2 = self.relu1_2(relu1_1)
-
-        relu2_1 = self.relu2_1(relu1_2)
-        relu2_2 = self.relu2_2(relu2_1)
-
-        relu3_1 = self.relu3_1(relu2_2)
-        relu3_2 = self.relu3_2(relu3_1)
-        relu3_3 = self.relu3_3(relu3_2)
-        relu3_4 = self.relu3_4(relu3_3)
-
-        relu4_1 = self.relu4_1(relu3_4)
-        relu4_2 = self.relu4_2(relu4_1)
-        relu4_3 = self.relu4_3(relu4_2)
-        relu4_4 = self.relu4_4(relu4_3)
-
-        relu5_1 = self.relu5_1(relu4_4)
-        relu5_2 = self.relu5_2(relu5_1)
-        relu5_3 = self.relu5_3(relu5_2)
-        relu5_4 = self.relu5_4(relu5_3)
-
-        out = {
-            'relu1_1': relu1_1,
-            'relu1_2': relu1_2,
-
-            'relu2_1': relu2_1,
-            'relu2_2': relu2_2,
-
-            'relu3_1': relu3_1,
-            'relu3_2': relu3_2,
-            'relu3_3': relu3_3,
-            'relu3_4': relu3_4,
-
-            'relu4_1': relu4_1,
-            'relu4_2': relu4_2,
-            'relu4_3': relu4_3,
-            'relu4_4': relu4_4,
-
-            'relu5_1': relu5_1,
-            'relu5_2': relu5_2,
-            'relu5_3': relu5_3,
-            'relu5_4': relu5_4,
-        }
+        out = {}
+        for name in self.names:
+            x = getattr(self, name)(x)
+            out[name] = x
+
         return out
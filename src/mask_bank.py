@@ -0,0 +1,88 @@
+import os
+import random
+import numpy as np
+from multiprocessing import Pool
+
+
+class MaskBank():
+    r"""Pre-generated masks with O(1) random access
+
+    Masks are stored bit-packed along the width in a single (N, H, ceil(W / 8))
+    uint8 .npy that is memory-mapped, the hole ratio of every mask is stored in
+    an index next to it (<name>.index.npz). With bins > 0, sample() first picks
+    one of `bins` equal-width hole ratio ranges uniformly, then a mask within it.
+    """
+
+    def __init__(self, path, bins=0):
+        self.masks = np.load(path, mmap_mode='r')
+
+        with np.load(os.path.splitext(path)[0] + '.index.npz') as index:
+            self.width = int(index['width'])
+            self.ratios = index['ratios']
+
+        # masks sorted by hole ratio, split into non-empty bins
+        self.bins = []
+        if bins > 0 and len(self.ratios) > 0:
+            order = np.argsort(self.ratios, kind='stable')
+            edges = np.linspace(self.ratios.min(), self.ratios.max(), bins + 1)[1:-1]
+            splits = np.searchsorted(self.ratios[order], edges, side='right')
+            self.bins = [b for b in np.split(order, splits) if len(b) > 0]
+
+    def __len__(self):
+        return len(self.masks)
+
+    def load(self, index):
+        r"""returns the (H, W) uint8 mask at index, holes are 255"""
+        mask = np.unpackbits(self.masks[index], axis=-1)[:, :self.width]
+        return mask * 255
+
+    def sample(self):
+        if self.bins:
+            indices = self.bins[np.random.randint(0, len(self.bins))]
+            return self.load(indices[np.random.randint(0, len(indices))])
+
+        return self.load(np.random.randint(0, len(self.masks)))
+
+
+def _init_worker(d, s):
+    global draw, seed
+    draw, seed = d, s
+
+
+def _draw_chunk(chunk):
+    start, end = chunk
+
+    # every chunk gets its own seed so worker processes don't draw the same masks
+    if seed is not None:
+        random.seed(seed + start)
+        np.random.seed((seed + start) % 2 ** 32)
+    else:
+        random.seed()
+        np.random.seed()
+
+    masks = np.stack([np.asarray(draw()) > 0 for _ in range(start, end)])
+    return start, np.packbits(masks, axis=-1), masks.mean(axis=(1, 2))
+
+
+def create_mask_bank(path, count, height, width, draw, workers=4, seed=None, chunk_size=256):
+    r"""draws `count` masks in parallel into a MaskBank at path (.npy)
+
+    Args:
+        draw (callable): picklable function returning a (height, width) mask, non-zero pixels are holes
+    """
+    masks = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(count, height, (width + 7) // 8))
+    ratios = np.zeros(count, dtype=np.float32)
+
+    done = 0
+    chunks = [(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+    with Pool(workers, initializer=_init_worker, initargs=(draw, seed)) as pool:
+        for start, packed, ratio in pool.imap_unordered(_draw_chunk, chunks):
+            masks[start:start + len(packed)] = packed
+            ratios[start:start + len(packed)] = ratio
+            done += len(packed)
+            print('%d/%d masks generated' % (done, count))
+
+    masks.flush()
+    del masks
+
+    np.savez(os.path.splitext(path)[0] + '.index.npz', width=width, height=height, ratios=ratios)
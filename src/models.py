@@ -3,62 +3,219 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 from .networks import InpaintGenerator, EdgeGenerator, Discriminator
-from .loss import AdversarialLoss, PerceptualLoss, StyleLoss
+from .loss import AdversarialLoss, PerceptualLoss, StyleLoss, VGG19
+from .distributed import all_reduce_gradients
+from .checkpoint import CheckpointWriter, load_checkpoint
+
+
+BACKENDS = ('torch', 'torchscript', 'onnx', 'int8')
+
+PRECISIONS = {
+    'fp32': None,
+    'fp16': torch.float16,
+    'bf16': torch.bfloat16,
+}
 
 
 class BaseModel(nn.Module):
-    def __init__(self, name, config):
+    def __init__(self, name, config, inference=False):
         super(BaseModel, self).__init__()
 
         self.name = name
         self.config = config
+        self.inference = inference
         self.iteration = 0
+        self.best = None
 
         self.gen_weights_path = os.path.join(config.PATH, name + '_gen.pth')
         self.dis_weights_path = os.path.join(config.PATH, name + '_dis.pth')
+        self.gen_script_path = os.path.join(config.PATH, name + '_gen.pt')
+        self.gen_onnx_path = os.path.join(config.PATH, name + '_gen.onnx')
+        self.gen_int8_path = os.path.join(config.PATH, name + '_gen_int8.pt')
+
+        # inference from an exported artifact instead of the python modules (see export.py)
+        if config.BACKEND not in BACKENDS:
+            raise ValueError('unknown BACKEND %r, expected one of %s' % (config.BACKEND, ', '.join(BACKENDS)))
+        self.backend = config.BACKEND if inference else 'torch'
+        self.session = None
+
+        # mixed precision: networks run under autocast, losses are computed in fp32
+        if config.PRECISION not in PRECISIONS:
+            raise ValueError('unknown PRECISION %r, expected one of %s' % (config.PRECISION, ', '.join(PRECISIONS)))
+        self.precision = PRECISIONS[config.PRECISION]
+
+        # dynamic loss scaling keeps small fp16 gradients from underflowing (no-op otherwise)
+        if not inference:
+            device_type = torch.device(config.DEVICE or 'cpu').type
+            self.gen_scaler = torch.amp.GradScaler(device_type, enabled=config.PRECISION == 'fp16')
+            self.dis_scaler = torch.amp.GradScaler(device_type, enabled=config.PRECISION == 'fp16')
+
+            # checkpoints are written in the background, training doesn't wait for the disk
+            self.checkpoints = CheckpointWriter(config.CHECKPOINT_KEEP)
+
+    def load_script(self, path, format='torchscript', device=None):
+        r"""loads a scripted, frozen generator exported by export.py"""
+        if not os.path.exists(path):
+            raise FileNotFoundError('%s not found, export it first: python export.py --format %s --checkpoints %s' % (path, format, self.config.PATH))
+
+        print('Loading %s scripted generator...' % self.name)
+        return torch.jit.load(path, map_location=device or self.config.DEVICE)
+
+    def load_onnx(self):
+        r"""creates an ONNX Runtime (cpu) session on the graph exported by export.py --format onnx"""
+        import onnxruntime
+
+        if not os.path.exists(self.gen_onnx_path):
+            raise FileNotFoundError('%s not found, export it first: python export.py --format onnx --checkpoints %s' % (self.gen_onnx_path, self.config.PATH))
+
+        print('Loading %s onnx graph...' % self.name)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.config.ONNX_THREADS
+        return onnxruntime.InferenceSession(self.gen_onnx_path, options, providers=['CPUExecutionProvider'])
+
+    def run_onnx(self, *inputs):
+        r"""runs the onnx session on torch tensors, the output is returned on the device of the inputs"""
+        feeds = {arg.name: x.detach().cpu().numpy() for arg, x in zip(self.session.get_inputs(), inputs)}
+        outputs = self.session.run(None, feeds)[0]
+        return torch.from_numpy(outputs).to(inputs[0].device)
 
     def load(self):
+        # exported generators carry their weights
+        if self.backend == 'torchscript':
+            # device specific fusions (mkldnn on cpu) can't be serialized, they are applied once loaded
+            self.generator = torch.jit.optimize_for_inference(self.load_script(self.gen_script_path))
+            return
+
+        # quantized kernels are cpu only, the inputs must be on cpu too (main.init sets DEVICE accordingly)
+        if self.backend == 'int8':
+            if torch.device(self.config.DEVICE or 'cpu').type != 'cpu':
+                raise ValueError('BACKEND int8 runs on cpu only, got DEVICE %s' % self.config.DEVICE)
+            self.generator = self.load_script(self.gen_int8_path, 'int8', 'cpu')
+            return
+
+        if self.backend == 'onnx':
+            self.session = self.load_onnx()
+            return
+
         if os.path.exists(self.gen_weights_path):
             print('Loading %s generator...' % self.name)
+            data = load_checkpoint(self.gen_weights_path)
 
-            if torch.cuda.is_available():
-                data = torch.load(self.gen_weights_path)
+            if self.inference:
+                # the meta parameters are replaced by the memory mapped checkpoint tensors (no copy on cpu)
+                self.generator.load_state_dict(data['generator'], assign=True)
+                self.generator.to(self.config.DEVICE)
             else:
-                data = torch.load(self.gen_weights_path, map_location=lambda storage, loc: storage)
+                self.generator.load_state_dict(data['generator'])
 
-            self.generator.load_state_dict(data['generator'])
             self.iteration = data['iteration']
+            self.best = data.get('best')
+
+            # optimizer and loss scaler state, training resumes exactly where it stopped
+            if not self.inference and self.config.MODE == 1 and 'optimizer' in data:
+                self.gen_optimizer.load_state_dict(data['optimizer'])
+                # checkpoints saved with the scaler disabled (fp32, bf16) hold an empty state
+                if data.get('scaler'):
+                    self.gen_scaler.load_state_dict(data['scaler'])
+
+        elif self.inference:
+            raise FileNotFoundError('%s not found' % self.gen_weights_path)
 
         # load discriminator only when training
-        if self.config.MODE == 1 and os.path.exists(self.dis_weights_path):
+        if not self.inference and self.config.MODE == 1 and os.path.exists(self.dis_weights_path):
             print('Loading %s discriminator...' % self.name)
+            data = load_checkpoint(self.dis_weights_path)
+            self.discriminator.load_state_dict(data['discriminator'])
 
-            if torch.cuda.is_available():
-                data = torch.load(self.dis_weights_path)
-            else:
-                data = torch.load(self.dis_weights_path, map_location=lambda storage, loc: storage)
+            if 'optimizer' in data:
+                self.dis_optimizer.load_state_dict(data['optimizer'])
+                if data.get('scaler'):
+                    self.dis_scaler.load_state_dict(data['scaler'])
 
-            self.discriminator.load_state_dict(data['discriminator'])
+    def autocast(self):
+        r"""autocast context for the configured PRECISION, disabled for fp32"""
+        device_type = torch.device(self.config.DEVICE or 'cpu').type
+        return torch.autocast(device_type, dtype=self.precision, enabled=self.precision is not None)
+
+    def discriminate(self, real, fake):
+        r"""runs real and fake inputs through the discriminator as a single batch
+
+        Returns:
+            real outputs, fake outputs and the real features (detached, for feature matching), in fp32
+        """
+        b = real.shape[0]
+        with self.autocast():
+            outputs, features = self.discriminator(torch.cat((real, fake), dim=0))
+
+        outputs = outputs.float()
+        return outputs[:b], outputs[b:], [feat[:b].detach().float() for feat in features]
+
+    def backward(self, gen_loss=None, dis_loss=None):
+        # the generator loss goes through the discriminator, whose weights its step modifies in place,
+        # so the generator backward runs first and the discriminator gradients it leaves are dropped
+        if gen_loss is not None:
+            self.gen_scaler.scale(gen_loss).backward()
+        self.dis_optimizer.zero_grad()
+
+        # gradients are averaged over the processes of a distributed run before every step,
+        # scaler steps are skipped (and the scale lowered) when fp16 gradients overflowed
+        if dis_loss is not None:
+            self.dis_scaler.scale(dis_loss).backward()
+            all_reduce_gradients(self.discriminator.parameters())
+            self.dis_scaler.step(self.dis_optimizer)
+            self.dis_scaler.update()
+
+        if gen_loss is not None:
+            all_reduce_gradients(self.generator.parameters())
+            self.gen_scaler.step(self.gen_optimizer)
+            self.gen_scaler.update()
+
+    def save(self, best=False):
+        r"""queues the generator and discriminator checkpoints (weights, optimizer and loss scaler state)
+
+        Args:
+            best (bool): also keep them as the best checkpoints (*_best.pth)
+        """
+        if self.inference:
+            raise RuntimeError('%s was built for inference only and cannot be saved' % self.name)
 
-    def save(self):
         print('\nsaving %s...\n' % self.name)
-        torch.save({
+        self.checkpoints.save(self.gen_weights_path, {
             'iteration': self.iteration,
-            'generator': self.generator.state_dict()
-        }, self.gen_weights_path)
+            'best': self.best,
+            'generator': self.generator.state_dict(),
+            'optimizer': self.gen_optimizer.state_dict(),
+            'scaler': self.gen_scaler.state_dict(),
+        }, self.iteration, best)
 
-        torch.save({
-            'discriminator': self.discriminator.state_dict()
-        }, self.dis_weights_path)
+        self.checkpoints.save(self.dis_weights_path, {
+            'discriminator': self.discriminator.state_dict(),
+            'optimizer': self.dis_optimizer.state_dict(),
+            'scaler': self.dis_scaler.state_dict(),
+        }, self.iteration, best)
 
 
 class EdgeModel(BaseModel):
-    def __init__(self, config):
-        super(EdgeModel, self).__init__('EdgeModel', config)
+    def __init__(self, config, inference=False):
+        super(EdgeModel, self).__init__('EdgeModel', config, inference)
 
         # generator input: [grayscale(1) + edge(1) + mask(1)]
         # discriminator input: (grayscale(1) + edge(1))
-        generator = EdgeGenerator(use_spectral_norm=True)
+        # exported generator: nothing to build, load() reads the artifact
+        if self.backend != 'torch':
+            return
+
+        # inference: built on the meta device without allocating weights, load() maps them from the checkpoint
+        with torch.device('meta' if inference else 'cpu'):
+            generator = EdgeGenerator(use_spectral_norm=True, init_weights=not inference)
+
+        # inference only: the generator is all we need, weights come from the checkpoint
+        if inference:
+            if len(config.GPU) > 1:
+                generator = nn.DataParallel(generator, config.GPU)
+            self.add_module('generator', generator)
+            return
+
         discriminator = Discriminator(in_channels=2, use_sigmoid=config.GAN_LOSS != 'hinge')
         if len(config.GPU) > 1:
             generator = nn.DataParallel(generator, config.GPU)
@@ -100,10 +257,10 @@ class EdgeModel(BaseModel):
 
 
         # discriminator loss
+        # real and fake go through the discriminator in one batched pass, it has no batch statistics
         dis_input_real = torch.cat((images, edges), dim=1)
         dis_input_fake = torch.cat((images, outputs.detach()), dim=1)
-        dis_real, dis_real_feat = self.discriminator(dis_input_real)        # in: (grayscale(1) + edge(1))
-        dis_fake, dis_fake_feat = self.discriminator(dis_input_fake)        # in: (grayscale(1) + edge(1))
+        dis_real, dis_fake, dis_real_feat = self.discriminate(dis_input_real, dis_input_fake)     # in: (grayscale(1) + edge(1))
         dis_real_loss = self.adversarial_loss(dis_real, True, True)
         dis_fake_loss = self.adversarial_loss(dis_fake, False, True)
         dis_loss += (dis_real_loss + dis_fake_loss) / 2
@@ -111,15 +268,16 @@ class EdgeModel(BaseModel):
 
         # generator adversarial loss
         gen_input_fake = torch.cat((images, outputs), dim=1)
-        gen_fake, gen_fake_feat = self.discriminator(gen_input_fake)        # in: (grayscale(1) + edge(1))
-        gen_gan_loss = self.adversarial_loss(gen_fake, True, False)
+        with self.autocast():
+            gen_fake, gen_fake_feat = self.discriminator(gen_input_fake)    # in: (grayscale(1) + edge(1))
+        gen_gan_loss = self.adversarial_loss(gen_fake.float(), True, False)
         gen_loss += gen_gan_loss
 
 
         # generator feature matching loss
         gen_fm_loss = 0
         for i in range(len(dis_real_feat)):
-            gen_fm_loss += self.l1_loss(gen_fake_feat[i], dis_real_feat[i].detach())
+            gen_fm_loss += self.l1_loss(gen_fake_feat[i].float(), dis_real_feat[i])
         gen_fm_loss = gen_fm_loss * self.config.FM_LOSS_WEIGHT
         gen_loss += gen_fm_loss
 
@@ -134,37 +292,52 @@ class EdgeModel(BaseModel):
         return outputs, gen_loss, dis_loss, logs
 
     def forward(self, images, edges, masks):
+        # the onnx graph includes the masking below
+        if self.session is not None:
+            return self.run_onnx(images, edges, masks)
+
         edges_masked = (edges * (1 - masks))
         images_masked = (images * (1 - masks)) + masks
         inputs = torch.cat((images_masked, edges_masked, masks), dim=1)
-        outputs = self.generator(inputs)                                    # in: [grayscale(1) + edge(1) + mask(1)]
-        return outputs
-
-    def backward(self, gen_loss=None, dis_loss=None):
-        if dis_loss is not None:
-            dis_loss.backward()
-        self.dis_optimizer.step()
-
-        if gen_loss is not None:
-            gen_loss.backward()
-        self.gen_optimizer.step()
+        if self.backend == 'torchscript':
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        with self.autocast():
+            outputs = self.generator(inputs)                                # in: [grayscale(1) + edge(1) + mask(1)]
+        return outputs.float()
 
 
 class InpaintingModel(BaseModel):
-    def __init__(self, config):
-        super(InpaintingModel, self).__init__('InpaintingModel', config)
+    def __init__(self, config, inference=False):
+        super(InpaintingModel, self).__init__('InpaintingModel', config, inference)
 
         # generator input: [rgb(3) + edge(1)]
         # discriminator input: [rgb(3)]
-        generator = InpaintGenerator()
+        # exported generator: nothing to build, load() reads the artifact
+        if self.backend != 'torch':
+            return
+
+        # inference: built on the meta device without allocating weights, load() maps them from the checkpoint
+        with torch.device('meta' if inference else 'cpu'):
+            generator = InpaintGenerator(init_weights=not inference)
+
+        # inference only: no discriminator, optimizers or VGG-based losses
+        if inference:
+            if len(config.GPU) > 1:
+                generator = nn.DataParallel(generator, config.GPU)
+            self.add_module('generator', generator)
+            return
+
         discriminator = Discriminator(in_channels=3, use_sigmoid=config.GAN_LOSS != 'hinge')
         if len(config.GPU) > 1:
             generator = nn.DataParallel(generator, config.GPU)
             discriminator = nn.DataParallel(discriminator , config.GPU)
 
+        # a single frozen VGG19, cut after relu5_2, serves both the perceptual and the style loss
+        vgg = VGG19(last_layer='relu5_2')
+
         l1_loss = nn.L1Loss()
-        perceptual_loss = PerceptualLoss()
-        style_loss = StyleLoss()
+        perceptual_loss = PerceptualLoss(vgg=vgg)
+        style_loss = StyleLoss(vgg=vgg)
         adversarial_loss = AdversarialLoss(type=config.GAN_LOSS)
 
         self.add_module('generator', generator)
@@ -202,10 +375,10 @@ class InpaintingModel(BaseModel):
 
 
         # discriminator loss
+        # real and fake go through the discriminator in one batched pass, it has no batch statistics
         dis_input_real = images
         dis_input_fake = outputs.detach()
-        dis_real, _ = self.discriminator(dis_input_real)                    # in: [rgb(3)]
-        dis_fake, _ = self.discriminator(dis_input_fake)                    # in: [rgb(3)]
+        dis_real, dis_fake, _ = self.discriminate(dis_input_real, dis_input_fake)   # in: [rgb(3)]
         dis_real_loss = self.adversarial_loss(dis_real, True, True)
         dis_fake_loss = self.adversarial_loss(dis_fake, False, True)
         dis_loss += (dis_real_loss + dis_fake_loss) / 2
@@ -213,8 +386,9 @@ class InpaintingModel(BaseModel):
 
         # generator adversarial loss
         gen_input_fake = outputs
-        gen_fake, _ = self.discriminator(gen_input_fake)                    # in: [rgb(3)]
-        gen_gan_loss = self.adversarial_loss(gen_fake, True, False) * self.config.INPAINT_ADV_LOSS_WEIGHT
+        with self.autocast():
+            gen_fake, _ = self.discriminator(gen_input_fake)                # in: [rgb(3)]
+        gen_gan_loss = self.adversarial_loss(gen_fake.float(), True, False) * self.config.INPAINT_ADV_LOSS_WEIGHT
         gen_loss += gen_gan_loss
 
 
@@ -224,13 +398,15 @@ class InpaintingModel(BaseModel):
 
 
         # generator perceptual loss
-        gen_content_loss = self.perceptual_loss(outputs, images)
+        with self.autocast():
+            gen_content_loss = self.perceptual_loss(outputs, images)
         gen_content_loss = gen_content_loss * self.config.CONTENT_LOSS_WEIGHT
         gen_loss += gen_content_loss
 
 
         # generator style loss
-        gen_style_loss = self.style_loss(outputs * masks, images * masks)
+        with self.autocast():
+            gen_style_loss = self.style_loss(outputs * masks, images * masks)
         gen_style_loss = gen_style_loss * self.config.STYLE_LOSS_WEIGHT
         gen_loss += gen_style_loss
 
@@ -247,14 +423,42 @@ class InpaintingModel(BaseModel):
         return outputs, gen_loss, dis_loss, logs
 
     def forward(self, images, edges, masks):
+        # the onnx graph includes the masking below
+        if self.session is not None:
+            return self.run_onnx(images, edges, masks)
+
         images_masked = (images * (1 - masks).float()) + masks
         inputs = torch.cat((images_masked, edges), dim=1)
-        outputs = self.generator(inputs)                                    # in: [rgb(3) + edge(1)]
-        return outputs
-
-    def backward(self, gen_loss=None, dis_loss=None):
-        dis_loss.backward()
-        self.dis_optimizer.step()
-
-        gen_loss.backward()
-        self.gen_optimizer.step()
+        if self.backend == 'torchscript':
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        with self.autocast():
+            outputs = self.generator(inputs)                                # in: [rgb(3) + edge(1)]
+        return outputs.float()
+
+
+def merged_forward(model, edge_model, inpaint_model, images, images_gray, edges, masks):
+    r"""test mode forward of MODEL, returns the outputs merged with the known pixels"""
+    # edge model
+    if model == 1:
+        outputs = edge_model(images_gray, edges, masks)
+        outputs_merged = (outputs * masks) + (edges * (1 - masks))
+
+    # inpaint model
+    elif model == 2:
+        outputs = inpaint_model(images, edges, masks)
+        outputs_merged = (outputs * masks) + (images * (1 - masks))
+
+    # inpaint with edge model / joint model
+    else:
+        edges = edge_model(images_gray, edges, masks).detach()
+        outputs = inpaint_model(images, edges, masks)
+        outputs_merged = (outputs * masks) + (images * (1 - masks))
+
+    return outputs_merged
+
+
+def postprocess(img):
+    # [0, 1] => [0, 255]
+    img = img * 255.0
+    img = img.permute(0, 2, 3, 1)
+    return img.int()
@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+from torch.nn.utils.spectral_norm import SpectralNorm
 
 
 class BaseNetwork(nn.Module):
@@ -205,8 +206,24 @@ class ResnetBlock(nn.Module):
         return out
 
 
+class FP32SpectralNorm(SpectralNorm):
+    r"""
+    Spectral norm hook whose power iterations and weight normalization
+    always run in fp32, even inside an autocast region
+    """
+
+    def __call__(self, module, inputs):
+        with torch.autocast(inputs[0].device.type, enabled=False):
+            super(FP32SpectralNorm, self).__call__(module, inputs)
+
+
 def spectral_norm(module, mode=True):
     if mode:
-        return nn.utils.spectral_norm(module)
+        module = nn.utils.spectral_norm(module)
+        for hook in module._forward_pre_hooks.values():
+            if isinstance(hook, SpectralNorm):
+                hook.__class__ = FP32SpectralNorm
+
+        return module
 
     return module
@@ -0,0 +1,214 @@
+import cv2
+from functools import lru_cache
+import numpy as np
+import torch
+import torch.nn as nn
+from .networks import EdgeGenerator, InpaintGenerator
+
+
+def tile_origins(start, end, length, size, stride):
+    r"""origins of the tiles of `size` every `stride` pixels covering [start, end), kept inside [0, length)"""
+    # a single tile spans the whole length
+    if size >= length:
+        return [0]
+
+    first = min(max(start, 0), length - size)
+    last = min(max(end - size, first), length - size)
+    return list(range(first, last, stride)) + [last]
+
+
+def feather(length, overlap, start, end, device):
+    r"""1d blending weights of a tile, ramps up over `overlap` pixels on the sides not at the image border"""
+    weights = torch.ones(length, device=device)
+    if overlap > 0:
+        ramp = torch.arange(1, overlap + 1, dtype=torch.float32, device=device) / (overlap + 1)
+        if start:
+            weights[:overlap] = ramp
+        if end:
+            weights[-overlap:] = torch.min(weights[-overlap:], ramp.flip(0))
+
+    return weights
+
+
+def tiled_forward(forward, inputs, base, size, overlap=32, batch_size=4):
+    r"""runs forward on overlapping tiles around the holes only and blends them back
+
+    The bounding box of the holes of every image is covered with size x size
+    tiles overlapping by `overlap` pixels, tiles without holes are skipped and
+    the others are run `batch_size` at a time. Overlapping tiles are blended
+    with linear ramps, pixels outside every tile are taken from base, so
+    memory is bounded by the tile size and compute by the area of the holes.
+
+    Args:
+        forward (callable): called with the tiles of inputs, returns merged outputs
+        inputs (tuple): (B, C, H, W) tensors forward is called with, masks last
+        base (torch.Tensor): known pixels kept by the merged outputs (edges for the edge model, images otherwise)
+        size (int): tile size, rounded down to a multiple of 4
+        overlap (int): overlap of neighbouring tiles, smaller than size
+
+    Returns:
+        merged outputs for the whole images, shaped like base
+    """
+    size = size - size % 4
+    if not 0 <= overlap < size:
+        raise ValueError('tile overlap (%d) must be in [0, tile size (%d))' % (overlap, size))
+
+    # the whole input fits in one tile
+    height, width = base.shape[2:]
+    if height <= size and width <= size:
+        return forward(*inputs)
+
+    tile_h, tile_w = min(size, height), min(size, width)
+    outputs = torch.zeros_like(base)
+    weights = torch.zeros_like(base[:, :1])
+
+    for i in range(base.shape[0]):
+        holes = inputs[-1][i, 0] > 0
+        if not holes.any():
+            continue
+
+        rows = torch.nonzero(holes.any(dim=1)).flatten()
+        cols = torch.nonzero(holes.any(dim=0)).flatten()
+        ys = tile_origins(rows[0].item() - overlap, rows[-1].item() + 1 + overlap, height, tile_h, tile_h - overlap)
+        xs = tile_origins(cols[0].item() - overlap, cols[-1].item() + 1 + overlap, width, tile_w, tile_w - overlap)
+        tiles = [(y, x) for y in ys for x in xs if holes[y:y + tile_h, x:x + tile_w].any()]
+
+        for start in range(0, len(tiles), batch_size):
+            batch = tiles[start:start + batch_size]
+            tile_inputs = [torch.cat([t[i:i + 1, :, y:y + tile_h, x:x + tile_w] for y, x in batch]) for t in inputs]
+
+            for (y, x), tile in zip(batch, forward(*tile_inputs)):
+                weight_y = feather(tile_h, overlap, y > 0, y + tile_h < height, tile.device)
+                weight_x = feather(tile_w, overlap, x > 0, x + tile_w < width, tile.device)
+                weight = weight_y[:, None] * weight_x[None, :]
+                outputs[i, :, y:y + tile_h, x:x + tile_w] += tile * weight
+                weights[i, :, y:y + tile_h, x:x + tile_w] += weight
+
+    # blending rounds the known pixels inside the tiles, they are copied back exactly
+    outputs = torch.where(weights > 0, outputs / weights.clamp(min=1e-8), base)
+    masks = inputs[-1]
+    return (outputs * masks) + (base * (1 - masks))
+
+
+def receptive_field(network):
+    r"""receptive field (pixels) of a convolutional network, from its layers in definition order"""
+    rf, jump = 1, 1
+    for m in network.modules():
+        if isinstance(m, nn.ConvTranspose2d):
+            # every output pixel depends on ceil(k / stride) input pixels
+            jump = jump / m.stride[0]
+            rf += (-(-m.kernel_size[0] // m.stride[0]) - 1) * m.dilation[0] * jump * m.stride[0]
+        elif isinstance(m, nn.Conv2d):
+            rf += (m.kernel_size[0] - 1) * m.dilation[0] * jump
+            jump = jump * m.stride[0]
+
+    return int(rf)
+
+
+@lru_cache(maxsize=None)
+def roi_margin(model):
+    r"""pixels around the holes that feed the outputs of MODEL, half the receptive field
+    rounded up to a multiple of 4 (stages 3 and 4 chain both generators)
+    """
+    # only the layer shapes are read, the generators are built on the meta device without weights
+    rf = 0
+    with torch.device('meta'):
+        if model in (1, 3, 4):
+            rf += receptive_field(EdgeGenerator(init_weights=False))
+        if model in (2, 3, 4):
+            rf += receptive_field(InpaintGenerator(init_weights=False))
+    if model in (3, 4):
+        rf -= 1
+
+    return -(-(rf // 2) // 4) * 4
+
+
+def roi_boxes(holes, margin):
+    r"""boxes (y0, x0, y1, x1) around the connected components of a (H, W) hole map
+
+    Boxes are expanded by margin, aligned to multiples of 4 (the generators
+    downsample twice) and merged until none overlap.
+    """
+    height, width = holes.shape
+    count, _, stats, _ = cv2.connectedComponentsWithStats(holes.astype(np.uint8), connectivity=8)
+
+    boxes = []
+    for x, y, w, h, _ in stats[1:count].tolist():
+        boxes.append((
+            max(y - margin, 0) // 4 * 4,
+            max(x - margin, 0) // 4 * 4,
+            min(-(-(y + h + margin) // 4) * 4, height),
+            min(-(-(x + w + margin) // 4) * 4, width),
+        ))
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    return boxes
+
+
+def roi_forward(forward, inputs, base, margin, batch_size=4):
+    r"""runs forward on crops around the holes only and pastes them back
+
+    Every connected component of the holes is cropped with `margin` pixels of
+    context (see roi_margin), overlapping crops are merged and crops of the
+    same size are run `batch_size` at a time. Instance norm statistics come
+    from the crop, so results are close to, not equal to, whole image ones.
+
+    Args:
+        forward (callable): called with the crops of inputs, returns merged outputs
+        inputs (tuple): (B, C, H, W) tensors forward is called with, masks last
+        base (torch.Tensor): known pixels kept by the merged outputs (edges for the edge model, images otherwise)
+        margin (int): context around the holes, a multiple of 4
+
+    Returns:
+        merged outputs for the whole images, shaped like base
+    """
+    masks = inputs[-1]
+    outputs = base.clone()
+
+    # crops of all images grouped by size
+    crops = {}
+    for i in range(base.shape[0]):
+        for y0, x0, y1, x1 in roi_boxes((masks[i, 0] > 0).cpu().numpy(), margin):
+            crops.setdefault((y1 - y0, x1 - x0), []).append((i, y0, x0))
+
+    for (h, w), group in crops.items():
+        for start in range(0, len(group), batch_size):
+            batch = group[start:start + batch_size]
+            crop_inputs = [torch.cat([t[i:i + 1, :, y:y + h, x:x + w] for i, y, x in batch]) for t in inputs]
+
+            for (i, y, x), crop in zip(batch, forward(*crop_inputs)):
+                outputs[i, :, y:y + h, x:x + w] = crop
+
+    return (outputs * masks) + (base * (1 - masks))
+
+
+def test_forward(forward, inputs, base, config):
+    r"""runs forward as configured for test mode: on crops around the holes
+    (ROI_CROP), in tiles (TILE_SIZE, within the crops if both are set) or on
+    the whole images
+    """
+    run = forward
+    if config.TILE_SIZE > 0:
+        def run(*x):
+            return tiled_forward(
+                forward, x, x[2] if config.MODEL == 1 else x[0],
+                config.TILE_SIZE, config.TILE_OVERLAP, config.TILE_BATCH_SIZE)
+
+    if config.ROI_CROP != 0:
+        margin = config.ROI_MARGIN or roi_margin(config.MODEL)
+        return roi_forward(run, inputs, base, margin, config.TILE_BATCH_SIZE)
+
+    return run(*inputs)
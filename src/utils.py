@@ -1,3 +1,4 @@
+import io
 import os
 import sys
 import time
@@ -82,6 +83,30 @@ def imsave(img, path):
     im.save(path)
 
 
+def imdecode(data, mode='RGB', size=None):
+    r"""decodes an encoded image (bytes or file-like object) into a uint8 array
+
+    Args:
+        mode (str): PIL mode to convert to
+        size (list): optional [height, width] to resize to (bilinear)
+    """
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
+
+    im = Image.open(data).convert(mode)
+    if size is not None:
+        im = im.resize((size[1], size[0]), Image.BILINEAR)
+
+    return np.array(im)
+
+
+def imencode(img, format='PNG'):
+    r"""encodes a uint8 array into image bytes"""
+    buffer = io.BytesIO()
+    Image.fromarray(img.astype(np.uint8).squeeze()).save(buffer, format=format)
+    return buffer.getvalue()
+
+
 class Progbar(object):
     """Displays a progress bar.
 
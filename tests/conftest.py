@@ -0,0 +1,41 @@
+import os
+import shutil
+import pytest
+import torch
+from src.config import Config
+from src.networks import EdgeGenerator, InpaintGenerator
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES = os.path.join(ROOT, 'examples', 'psv')
+
+
+@pytest.fixture
+def checkpoints(tmp_path):
+    r"""checkpoints directory with the example config and randomly initialized generators"""
+    shutil.copy(os.path.join(ROOT, 'config.yml.example'), str(tmp_path / 'config.yml'))
+
+    torch.manual_seed(0)
+    torch.save({'iteration': 0, 'generator': EdgeGenerator(use_spectral_norm=True).state_dict()}, str(tmp_path / 'EdgeModel_gen.pth'))
+    torch.save({'iteration': 0, 'generator': InpaintGenerator().state_dict()}, str(tmp_path / 'InpaintingModel_gen.pth'))
+
+    return str(tmp_path)
+
+
+@pytest.fixture
+def make_config(checkpoints):
+    r"""loads the config of the checkpoints directory on cpu, with the example images and masks as test set"""
+    def make(**values):
+        config = Config(os.path.join(checkpoints, 'config.yml'))
+        config.DEVICE = torch.device('cpu')
+        config.GPU = [0]
+        config.TEST_FLIST = os.path.join(EXAMPLES, 'images')
+        config.TEST_MASK_FLIST = os.path.join(EXAMPLES, 'masks')
+        config.TEST_EDGE_FLIST = []
+
+        for name, value in values.items():
+            setattr(config, name, value)
+
+        return config
+
+    return make
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import torch
+from PIL import Image
+from skimage.color import rgb2gray
+from skimage.feature import canny
+from src.canny import Canny
+
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples', 'psv')
+
+
+def example_images(size=128):
+    images = []
+    for name in sorted(os.listdir(os.path.join(EXAMPLES, 'images')))[:4]:
+        img = Image.open(os.path.join(EXAMPLES, 'images', name)).convert('RGB').resize((size, size))
+        images.append(rgb2gray(np.array(img)))
+
+    return torch.from_numpy(np.stack(images)).float().unsqueeze(1)
+
+
+def test_batched_canny_matches_skimage():
+    images = example_images()
+    masks = torch.ones_like(images)
+    masks[:, :, 32:80, 40:100] = 0
+
+    # the batched path, run directly on cpu tensors
+    edges = Canny(2).canny(images, [2] * images.shape[0], masks)
+    expected = np.stack([canny(img[0].numpy(), sigma=2, mask=mask[0].numpy() > 0) for img, mask in zip(images, masks)])
+
+    mismatched = (edges[:, 0].numpy() > 0) != expected
+    assert mismatched.sum() <= 0.001 * expected.sum()
+
+
+def test_cpu_falls_back_to_skimage():
+    images = example_images()
+    edges = Canny(2)(images)
+    expected = np.stack([canny(img[0].numpy(), sigma=2) for img in images])
+
+    assert edges.dtype == images.dtype
+    assert np.array_equal(edges[:, 0].numpy() > 0, expected)
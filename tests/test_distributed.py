@@ -0,0 +1,91 @@
+import os
+import socket
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torchvision.models as models
+from src.config import Config
+from src.edge_connect import EdgeConnect
+from src.distributed import init_distributed, all_reduce_gradients, broadcast_module
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES = os.path.join(ROOT, 'examples', 'psv')
+WORLD_SIZE = 2
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_module():
+    return nn.Sequential(nn.Linear(4, 4), nn.BatchNorm1d(4))
+
+
+def run(rank, port, checkpoints, path):
+    r"""one gloo process of a local torchrun-like launch"""
+    os.environ.update(MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port), WORLD_SIZE=str(WORLD_SIZE), RANK=str(rank), LOCAL_RANK=str(rank))
+
+    config = Config(os.path.join(checkpoints, 'config.yml'))
+    config.DEVICE = torch.device('cpu')
+    config.DIST_BACKEND = 'gloo'
+    assert init_distributed(config)
+    assert (config.RANK, config.WORLD_SIZE) == (rank, WORLD_SIZE)
+
+    try:
+        # gradients are averaged over the processes
+        module = make_module()
+        for p in module.parameters():
+            p.grad = torch.full_like(p, rank + 1.0)
+        all_reduce_gradients(module.parameters())
+        for p in module.parameters():
+            assert torch.equal(p.grad, torch.full_like(p, 1.5))
+
+        # every process ends up with the parameters and buffers of rank 0
+        torch.manual_seed(rank)
+        module = make_module()
+        module[1].running_mean.fill_(rank)
+        broadcast_module(module)
+
+        torch.manual_seed(0)
+        expected = make_module()
+        for p, q in zip(module.state_dict().values(), expected.state_dict().values()):
+            assert torch.equal(p, q)
+
+        # every process trains, rank 0 alone writes checkpoints (each process gets its own PATH to tell them apart)
+        config.PATH = os.path.join(path, str(rank))
+        os.makedirs(config.PATH)
+        config.MODE = 1
+        config.MODEL = 1
+        config.MASK = 1
+        config.INPUT_SIZE = 64
+        config.BATCH_SIZE = 1
+        config.MAX_ITERS = 2
+        config.SAVE_INTERVAL = 1
+        config.SAMPLE_INTERVAL = 0
+        config.LOG_INTERVAL = 0
+        config.EVAL_INTERVAL = 0
+        config.NUM_WORKERS = 0
+        config.TRAIN_FLIST = config.VAL_FLIST = os.path.join(EXAMPLES, 'images')
+        config.TRAIN_EDGE_FLIST = config.VAL_EDGE_FLIST = []
+        config.TRAIN_MASK_FLIST = config.VAL_MASK_FLIST = []
+
+        # the edge model doesn't use the VGG losses of the inpaint model, skip downloading their weights
+        vgg19 = models.vgg19
+        models.vgg19 = lambda pretrained=False: vgg19()
+
+        model = EdgeConnect(config)
+        model.train()
+
+        saved = os.path.exists(os.path.join(config.PATH, 'EdgeModel_gen.pth'))
+        assert saved == (rank == 0)
+
+    finally:
+        dist.destroy_process_group()
+
+
+def test_gloo_processes(checkpoints, tmp_path):
+    mp.spawn(run, args=(free_port(), checkpoints, str(tmp_path)), nprocs=WORLD_SIZE)
@@ -0,0 +1,39 @@
+import numpy as np
+import torch
+from src.edge_connect import EdgeConnect
+from src.engine import InpaintEngine
+from src.models import postprocess
+
+
+def test_test_mode_loads_generators(make_config):
+    config = make_config(MODE=2, MODEL=3)
+    model = EdgeConnect(config)
+    model.load()
+
+    for m in (model.edge_model, model.inpaint_model):
+        assert all(p.device == torch.device('cpu') for p in m.parameters())
+
+    images, images_gray, edges, masks = (x.unsqueeze(0) for x in model.test_dataset[0])
+    with torch.no_grad():
+        outputs = model.forward(images, images_gray, edges, masks)
+
+    assert outputs.shape == images.shape
+    assert torch.isfinite(outputs).all()
+
+
+def test_engine_matches_test_mode(make_config):
+    config = make_config(MODE=2, MODEL=3)
+    model = EdgeConnect(config)
+    model.load()
+    model.edge_model.eval()
+    model.inpaint_model.eval()
+    engine = InpaintEngine(config)
+
+    image = model.test_dataset.load_resized(0)
+    mask = model.test_dataset.load_mask(image, 0)
+    images, images_gray, edges, masks = (x.unsqueeze(0) for x in model.test_dataset[0])
+
+    with torch.no_grad():
+        expected = postprocess(model.forward(images, images_gray, edges, masks))[0].numpy()
+
+    assert np.abs(engine.inpaint(image, mask).astype(int) - expected).max() <= 1
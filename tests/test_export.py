@@ -0,0 +1,34 @@
+import os
+import pytest
+import torch
+import export
+
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples', 'psv')
+
+
+@pytest.mark.parametrize('format', ['torchscript', 'onnx'])
+def test_export_matches_eager(make_config, format):
+    if format == 'onnx':
+        pytest.importorskip('onnx')
+        pytest.importorskip('onnxruntime')
+
+    config = make_config()
+    export.export(config, 3, format)
+
+    diff = export.check(config, 3, os.path.join(EXAMPLES, 'images'), os.path.join(EXAMPLES, 'masks'), format)
+    assert diff < 1e-3
+
+
+def test_int8_drift_from_eager(make_config):
+    if 'fbgemm' not in torch.backends.quantized.supported_engines and 'x86' not in torch.backends.quantized.supported_engines:
+        pytest.skip('no quantized cpu engine')
+
+    config = make_config()
+    export.export(config, 3, 'int8', samples=5)
+
+    # untrained generators quantize poorly, the int8 outputs must still follow the fp32 ones
+    # (~13dB) well above unrelated outputs (~8dB, the fp32 outputs against the ground truth)
+    psnr, mae = export.drift(config, 3, os.path.join(EXAMPLES, 'images'), os.path.join(EXAMPLES, 'masks'))
+    assert psnr > 10
+    assert mae < 0.5
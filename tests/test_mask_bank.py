@@ -0,0 +1,43 @@
+import os
+from functools import partial
+import numpy as np
+import pytest
+from src import dataset as dataset_module
+from src.dataset import Dataset
+from src.mask_bank import MaskBank, create_mask_bank
+from src.utils import create_irregular_mask
+
+
+@pytest.fixture
+def irregular_bank(tmp_path):
+    path = str(tmp_path / 'masks.npy')
+    create_mask_bank(path, 8, 64, 64, partial(create_irregular_mask, 64, 64, 0), workers=1, seed=0)
+    return path
+
+
+def test_bank_round_trip(irregular_bank):
+    bank = MaskBank(irregular_bank)
+    assert len(bank) == 8
+
+    mask = bank.load(3)
+    assert mask.shape == (64, 64)
+    assert set(np.unique(mask)) <= {0, 255}
+    assert np.isclose((mask > 0).mean(), np.load(os.path.splitext(irregular_bank)[0] + '.index.npz')['ratios'][3])
+
+
+@pytest.mark.parametrize('mask_type', [7, 8])
+def test_irregular_masks_come_from_the_bank(make_config, irregular_bank, monkeypatch, mask_type):
+    def draw(*args):
+        raise AssertionError('irregular mask drawn per sample')
+
+    monkeypatch.setattr(dataset_module, 'create_irregular_mask', draw)
+
+    config = make_config(MASK=mask_type)
+    dataset = Dataset(config, config.TEST_FLIST, [], irregular_bank, augment=False, training=True)
+    bank = MaskBank(irregular_bank)
+
+    for index in range(10):
+        mask = dataset.load_mask(np.zeros((64, 64, 3), np.uint8), index)
+        assert mask.shape == (64, 64)
+        if mask_type == 7:
+            assert any(np.array_equal(mask, bank.load(i)) for i in range(len(bank)))
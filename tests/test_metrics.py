@@ -0,0 +1,35 @@
+import numpy as np
+from PIL import Image
+from skimage.metrics import peak_signal_noise_ratio, structural_similarity
+from scipy.ndimage import gaussian_filter
+from scripts.metrics import compare_psnr, compare_ssim, evaluate
+
+
+def smooth_images(n=3, size=96, seed=0):
+    rng = np.random.RandomState(seed)
+    images = np.stack([gaussian_filter(rng.rand(size, size), 3) for _ in range(n)])
+    images = (images - images.min()) / (images.max() - images.min())
+    noisy = np.clip(images + 0.05 * rng.randn(*images.shape), 0, 1)
+    return images.astype(np.float32), noisy.astype(np.float32)
+
+
+def test_metrics_match_skimage():
+    img_true, img_test = smooth_images()
+
+    psnr = compare_psnr(img_true, img_test, data_range=1)
+    ssim = compare_ssim(img_true, img_test, data_range=1, win_size=51)
+    for i in range(len(img_true)):
+        expected_psnr = peak_signal_noise_ratio(img_true[i].astype(np.float64), img_test[i].astype(np.float64), data_range=1)
+        expected_ssim = structural_similarity(img_true[i].astype(np.float64), img_test[i].astype(np.float64), data_range=1, win_size=51)
+        assert np.isclose(psnr[i], expected_psnr, atol=1e-6)
+        assert np.isclose(ssim[i], expected_ssim, atol=1e-6)
+
+
+def test_evaluate_reads_images(tmp_path):
+    img_true, img_test = smooth_images(n=1)
+    (tmp_path / 'pred').mkdir()
+    Image.fromarray((img_true[0] * 255).astype(np.uint8)).convert('RGB').save(str(tmp_path / 'image.png'))
+    Image.fromarray((img_test[0] * 255).astype(np.uint8)).save(str(tmp_path / 'pred' / 'image.png'))
+
+    psnr, ssim, mae = evaluate([str(tmp_path / 'image.png')], str(tmp_path / 'pred'))
+    assert 15 < psnr[0] < 40 and 0 < ssim[0] < 1 and 0 < mae[0] < 1
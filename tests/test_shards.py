@@ -0,0 +1,22 @@
+import os
+import numpy as np
+from src.dataset import Dataset
+from make_shards import pack
+
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples', 'psv')
+
+
+def test_pack_round_trip(make_config, tmp_path):
+    config = make_config(INPUT_SIZE=64)
+    source = Dataset(config, os.path.join(EXAMPLES, 'images'), [], [], augment=False, training=False)
+
+    output = str(tmp_path / 'images.npy')
+    pack(source, output, workers=1)
+
+    packed = Dataset(config, output, [], [], augment=False, training=False)
+    assert len(packed) == len(source) == 5
+    assert list(packed.data) == list(source.data)
+
+    for index in range(len(source)):
+        assert np.array_equal(packed.packed[index], source.load_resized(index))
@@ -0,0 +1,19 @@
+import pytest
+import torch
+from src.tiling import tiled_forward
+
+
+def forward(images, masks):
+    # pointwise, so tiled and whole image outputs are equal
+    return (images * 0.5 + 0.25) * masks + images * (1 - masks)
+
+
+@pytest.mark.parametrize('height, width', [(32, 32), (32, 160), (160, 28), (160, 160)])
+def test_tiles_at_the_overlap_boundary(height, width):
+    torch.manual_seed(0)
+    images = torch.rand(2, 3, height, width)
+    masks = torch.zeros(2, 1, height, width)
+    masks[:, :, height // 4:height // 2, width // 4:-4] = 1
+
+    outputs = tiled_forward(forward, (images, masks), images, size=64, overlap=32)
+    assert torch.allclose(outputs, forward(images, masks), atol=1e-6)